@@ -1,20 +1,25 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import google.generativeai as genai
 import os
 from datetime import datetime
 from dotenv import load_dotenv
 
+# The model client, LLM cache and metrics are shared with the root app; run this app from the
+# repository root as a module (python -m Backend.app) so those modules are importable
+from core import instrument, llm_cache, overloaded
+from llm_limiter import OverloadedError
+from model_client import get_model
+
 # Load environment variables
 load_dotenv()
 
+# This API keeps its own model, separate from the root app's LLM_MODEL
+MODEL_NAME = os.getenv('BACKEND_LLM_MODEL', 'gemini-pro')
+model = get_model(MODEL_NAME)
+
 app = Flask(__name__)
 CORS(app)
-
-# Configure Google AI
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-pro')
+instrument(app)
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
@@ -51,7 +56,7 @@ Provide a comprehensive analysis that:
 '''
 
         # Generate analysis
-        ai_response = model.generate_content(analysis_prompt)
+        summary, cache_status = llm_cache.generate(model, MODEL_NAME, analysis_prompt, 'report')
         
         # Prepare response
         complete_analysis = {
@@ -62,13 +67,17 @@ Provide a comprehensive analysis that:
                 'analysis': analysis
             },
             'ai_analysis': {
-                'summary': ai_response.text,
+                'summary': summary,
                 'timestamp': datetime.now().isoformat()
             }
         }
 
-        return jsonify(complete_analysis)
+        response = jsonify(complete_analysis)
+        response.headers['X-LLM-Cache'] = cache_status
+        return response
 
+    except OverloadedError as e:
+        return overloaded(e)
     except Exception as e:
         print(f"Error in analyze endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -96,13 +105,17 @@ Provide a helpful response that:
 '''
 
         # Generate response
-        ai_response = model.generate_content(chat_prompt)
+        text, cache_status = llm_cache.generate(model, MODEL_NAME, chat_prompt)
         
-        return jsonify({
-            'response': ai_response.text,
+        response = jsonify({
+            'response': text,
             'timestamp': datetime.now().isoformat()
         })
+        response.headers['X-LLM-Cache'] = cache_status
+        return response
 
+    except OverloadedError as e:
+        return overloaded(e)
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
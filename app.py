@@ -1,32 +1,138 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, has_app_context, jsonify, make_response, request, stream_with_context
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from datetime import datetime
+from datetime import datetime, timezone
+import functools
+import hashlib
 import json
+import re
+import numpy as np
 import pandas as pd
-import requests
+import threading
+from cachetools import TTLCache
+from werkzeug.http import is_resource_modified
+from werkzeug.routing import BaseConverter
+from dataset import (CACHE_DIR, DEFAULT_ISO, UnknownCountryError, available_countries, country_workbook, get_country,
+                     get_dataset, memory_report, reload_on_request, resident_paths)
+from http_client import HTTPClient
+import metrics
+from metrics import span
+from compression import choose_encoding, compress_response, encode_body
+from json_provider import provider_from_env
+from result_cube import ResultCube, LOCATION_SENTINEL
+from rankings import rank
+from map_layers import LEVELS as MAP_LEVELS, METRICS as MAP_METRICS, MapLayers
+from trends import RECENT_YEARS, direction
+from llm_cache import MISS
+from llm_limiter import OverloadedError
+from prewarm import DemandTracker, Prewarmer
+from jobs import JobQueue
+from retrieval import FactIndex
+from core import MODEL_NAME, instrument, llm_cache, model, overloaded
 
 # Load environment variables
 load_dotenv()
 
+# Also sent by the routes asgi.py serves without Flask
+CORS_ORIGINS = '*'
+
 app = Flask(__name__)
-CORS(app)
+app.json = provider_from_env()(app)
+CORS(app, origins=CORS_ORIGINS)
+instrument(app)
+
+class IsoConverter(BaseConverter):
+    # Three-letter country code in /data/<iso>/... routes
+    regex = '[A-Za-z]{3}'
+
+    def to_python(self, value):
+        return value.upper()
+
+app.url_map.converters['iso'] = IsoConverter
 
 # Configure API keys
-GEMINI_KEY = os.getenv('GEMINI_API_KEY')
 SEARCH_KEY = os.getenv('GOOGLE_SEARCH_API_KEY')
 SEARCH_ENGINE_ID = os.getenv('GOOGLE_SEARCH_ENGINE_ID')
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_KEY)
+def generate_text(prompt, priority='chat'):
+    return llm_cache.generate(model, MODEL_NAME, prompt, priority)
+
+class RequestError(Exception):
+    # A client error from the validation the Flask views share with asgi.py
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def wants_event_stream():
+    return request.args.get('stream') in ('1', 'true', 'sse') or 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(prompt, first_event=None, priority='chat'):
+    # Structured payload first, then model tokens as they arrive, then a done event.
+    # The model slot is taken before the 200 goes out, so OverloadedError still reaches the view as a 503
+    chunks = llm_cache.stream(model, MODEL_NAME, prompt, priority)
 
-# Initialize the model with the correct name
+    def generate():
+        if first_event is not None:
+            yield sse(*first_event)
+        status = None
+        try:
+            for text, status in chunks:
+                yield sse('token', {'text': text})
+            yield sse('done', {'timestamp': datetime.now().isoformat(), 'cache': status})
+        except Exception as e:
+            print(f"Streaming error: {str(e)}")
+            yield sse('error', {'error': str(e)})
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Fill every (location, density) response body in the background once the dataset loads
+MATERIALIZE_RESULTS = os.getenv('FOREST_MATERIALIZE', '1') == '1'
+
+# Map the columnar dataset cache at import so pre-fork workers share its pages
 try:
-    model = genai.GenerativeModel('gemini-2.0-flash')  # Updated model name
+    get_dataset()
 except Exception as e:
-    print(f"Error initializing Gemini model: {str(e)}")
+    print(f"Error loading forest dataset: {str(e)}")
+
+@app.url_value_preprocessor
+def pull_country(endpoint, values):
+    if values and 'iso' in values:
+        g.iso = values.pop('iso')
+
+def country_dataset(iso):
+    if iso not in available_countries():
+        raise UnknownCountryError(iso)
+    # Loaded here so a workbook removed since the last listing is a 404, not a route's 500
+    return get_country(iso)
+
+def unknown_country(iso):
+    return {"error": f"No dataset for country {iso}"}
+
+@app.before_request
+def check_country():
+    iso = g.get('iso')
+    if iso is None:
+        return
+    try:
+        country_dataset(iso)
+    except UnknownCountryError:
+        return jsonify(unknown_country(iso)), 404
+
+def resident_countries():
+    return {iso for iso in available_countries() if country_workbook(iso) in resident_paths()}
+
+def current_dataset():
+    # The dataset of the /data/<iso>/... route being served, the default workbook otherwise
+    iso = g.get('iso') if has_app_context() else None
+    return get_country(iso) if iso is not None else get_dataset()
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
 
 def format_value(value, unit):
     if pd.isna(value): return "No data"
@@ -35,206 +141,710 @@ def format_value(value, unit):
     elif abs(value) >= 1e3: return f"{value/1e3:,.2f} K {unit}"
     return f"{value:,.2f} {unit}"
 
-def search_news(location):
+def format_values(values, unit):
+    # Vectorized format_value for a whole series; unit is one string or one per value
+    units = [unit] * len(values) if isinstance(unit, str) else unit
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    conditions = [magnitude >= 1e9, magnitude >= 1e6, magnitude >= 1e3]
+    scaled = values / np.select(conditions, [1e9, 1e6, 1e3], 1.0)
+    suffixes = np.select(conditions, ['B ', 'M ', 'K '], '')
+    return [
+        "No data" if missing else f"{value:,.2f} {suffix}{unit}"
+        for value, suffix, missing, unit in zip(scaled.tolist(), suffixes.tolist(), np.isnan(values).tolist(), units)
+    ]
+
+def yearly_values(values):
+    return np.where(np.isnan(values), None, values).tolist()
+
+def without_formatted(section):
+    # Compact shape: keep the raw numbers, drop the display strings
+    return {
+        key: without_formatted(value) if isinstance(value, dict) else value
+        for key, value in section.items() if key != 'formatted'
+    }
+
+def yearly_entries(labels, values, unit, formatted=None):
+    # formatted: the display strings, when the caller already made them
+    missing = np.isnan(values)
+    formatted = format_values(values, unit) if formatted is None else formatted
+    return {
+        label: {'value': value, 'formatted': text}
+        for label, value, text in zip(labels, np.where(missing, None, values).tolist(), formatted)
+    }
+
+def series_total(values):
+    # Sequential sum in year order, 0 when every year is missing
+    if np.isnan(values).all():
+        return 0
+    return float(np.nancumsum(values)[-1])
+
+# Pooled, retrying client for outbound search calls; replace it to point at a stub server
+SEARCH_URL = os.getenv('GOOGLE_SEARCH_URL', 'https://www.googleapis.com/customsearch/v1')
+search_client = HTTPClient(
+    timeout=(3.05, float(os.getenv('SEARCH_TIMEOUT', 10))),
+    retries=int(os.getenv('SEARCH_RETRIES', 2))
+)
+news_cache = TTLCache(maxsize=512, ttl=float(os.getenv('NEWS_CACHE_TTL', 1800)))
+news_cache_lock = threading.Lock()
+
+def search_news(location, client=None, refresh=False):
+    key = str(location).lower()
+    with news_cache_lock:
+        items = None if refresh else news_cache.get(key)
+    if items is not None:
+        metrics.cache_requests.inc('news', 'hit')
+        return items
+    metrics.cache_requests.inc('news', 'miss')
     try:
         search_query = f"forest conservation and carbon emissions and air pollution and air quality news in {location}"
-        response = requests.get(
-            "https://www.googleapis.com/customsearch/v1",
-            params={
-                "key": os.getenv('GOOGLE_SEARCH_API_KEY'),
-                "cx": os.getenv('GOOGLE_SEARCH_ENGINE_ID'),
-                "q": search_query,
-                "num": 5
-            }
-        )
-        return response.json().get('items', [])
+        with span('search'):
+            response = (client or search_client).get(
+                SEARCH_URL,
+                params={
+                    "key": os.getenv('GOOGLE_SEARCH_API_KEY'),
+                    "cx": os.getenv('GOOGLE_SEARCH_ENGINE_ID'),
+                    "q": search_query,
+                    "num": 5
+                }
+            )
+            response.raise_for_status()
+            items = response.json().get('items', [])
     except Exception as e:
+        metrics.upstream_errors.inc('search')
         print(f"Search error: {str(e)}")
         return []
+    with news_cache_lock:
+        news_cache[key] = items
+    return items
+
+def optional_float(value):
+    return None if np.isnan(value) else float(value)
+
+def locate_rows(dataset, location=None, density_threshold=None, is_country=False):
+    # (level, carbon_offset, tree_offset) for a location and threshold, None when absent
+    if is_country:
+        carbon_rows = np.flatnonzero(dataset.carbon('country')['umd_tree_cover_density_2000__threshold'].to_numpy() == density_threshold)
+        tree_rows = np.flatnonzero(dataset.tree('country')['threshold'].to_numpy() == density_threshold)
+        if len(carbon_rows) == 0 or len(tree_rows) == 0:
+            return None
+        return 'country', carbon_rows[0], tree_rows[0]
+    entry = dataset.index.resolve(location)
+    if entry is None:
+        return None
+    carbon_offset = entry.carbon_row(density_threshold)
+    tree_offset = entry.tree_row(density_threshold)
+    if carbon_offset is None or tree_offset is None:
+        return None
+    return entry.level, carbon_offset, tree_offset
+
+def recent_trends(data, years=RECENT_YEARS, dataset=None):
+    # Window summaries of the last `years` years for an analyze_data result
+    dataset = dataset or current_dataset()
+    located = locate_rows(dataset, data.get('location'), data.get('density_threshold'), data.get('location_type') == 'country')
+    if located is None:
+        raise ValueError("Location not found in the database.")
+    level, carbon_offset, tree_offset = located
+    tables = dataset.trends(level)
+    start = int(tables['tree_loss'].years[-years:][0])
+    return tables['tree_loss'].window(tree_offset, start), tables['emissions'].window(carbon_offset, start)
 
-def analyze_trends(data):
+def analyze_trends(data, dataset=None):
     try:
-        yearly_loss = data['yearly_data']['tree_loss']
-        yearly_emissions = data['yearly_data']['emissions']
-        
-        # Calculate trends
-        recent_years = list(range(2019, 2024))
-        recent_loss = [yearly_loss.get(str(year), {}).get('value', 0) for year in recent_years]
-        recent_emissions = [yearly_emissions.get(str(year), {}).get('value', 0) for year in recent_years]
-        
-        avg_recent_loss = sum(x for x in recent_loss if x is not None) / len([x for x in recent_loss if x is not None])
-        avg_recent_emissions = sum(x for x in recent_emissions if x is not None) / len([x for x in recent_emissions if x is not None])
-        
+        loss, emissions = recent_trends(data, dataset=dataset)
         return {
-            'recent_average_loss': avg_recent_loss,
-            'recent_average_emissions': avg_recent_emissions,
-            'trend': 'increasing' if recent_loss[-1] > recent_loss[0] else 'decreasing'
+            'recent_average_loss': optional_float(loss['mean']),
+            'recent_average_emissions': optional_float(emissions['mean']),
+            'trend': direction(loss['slope']),
+            'years_analyzed': list(range(loss['years'][0], loss['years'][1] + 1))
         }
     except Exception as e:
         print(f"Trend analysis error: {str(e)}")
         return {}
 
-def analyze_data(location=None, density_threshold=None, is_country=False):
-    try:
-        sheets = {
-            'carbon': 'Country carbon data' if is_country else 'Subnational 2 carbon data',
-            'tree': 'Country tree cover loss' if is_country else 'Subnational 2 tree cover loss'
+def trend_series(table, offset, start=None, end=None, window=3):
+    summary = table.window(offset, start, end)
+    first, last = table.bounds(start, end)
+    columns = slice(first, last + 1)
+    cumulative = table.cumulative(offset)[columns] - (float(table.total[offset, first - 1]) if first > 0 else 0.0)
+    return {
+        'mean': optional_float(summary['mean']),
+        'total': optional_float(summary['total']),
+        'slope': optional_float(summary['slope']),
+        'trend': direction(summary['slope']),
+        'yearly': {
+            'years': table.years[columns].tolist(),
+            'change': yearly_values(table.yoy[offset, columns]),
+            'rolling_mean': yearly_values(table.rolling_mean(offset, window)[columns]),
+            'cumulative': yearly_values(cumulative)
         }
-        
-        carbon_data = pd.read_excel('IND.xlsx', sheet_name=sheets['carbon'])
-        tree_data = pd.read_excel('IND.xlsx', sheet_name=sheets['tree'])
-        
-        if not is_country:
-            if location.lower() in [str(x).lower() for x in carbon_data['state'].dropna()]:
-                sheets['carbon'] = 'Subnational 1 carbon data'
-                sheets['tree'] = 'Subnational 1 tree cover loss'
-                carbon_data = pd.read_excel('IND.xlsx', sheet_name=sheets['carbon'])
-                tree_data = pd.read_excel('IND.xlsx', sheet_name=sheets['tree'])
-                location_type = 'state'
-            elif location.lower() in [str(x).lower() for x in carbon_data['district'].dropna()]:
-                location_type = 'district'
-            else:
-                return {"error": "Location not found in the database."}
+    }
 
-        # Filter and process data
-        if is_country:
-            thresholds = sorted(carbon_data['umd_tree_cover_density_2000__threshold'].unique())
-            if density_threshold is None:
-                return {'available_densities': thresholds}
-            carbon_row = carbon_data[carbon_data['umd_tree_cover_density_2000__threshold'] == density_threshold]
-            tree_row = tree_data[tree_data['threshold'] == density_threshold]
-        else:
-            carbon_row = carbon_data[carbon_data[location_type].str.contains(location, case=False, na=False)]
-            tree_row = tree_data[tree_data[location_type].str.contains(location, case=False, na=False)]
-            thresholds = sorted(carbon_row['umd_tree_cover_density_2000__threshold'].unique())
-            if density_threshold is None:
-                return {
-                    'location': location,
-                    'location_type': location_type,
-                    'available_densities': thresholds
-                }
-            carbon_row = carbon_row[carbon_row['umd_tree_cover_density_2000__threshold'] == density_threshold]
-            tree_row = tree_row[tree_row['threshold'] == density_threshold]
+# Figures of an analyze_data body in the order build_results formats them
+FIGURE_UNITS = ['hectares', 'Mg C', 'Mg C/ha', 'hectares', 'hectares', 'hectares', 'hectares', 'Mg CO₂e', 'hectares']
+
+def build_results(dataset, level, location, pairs, compact=False):
+    # analyze_data bodies of one location for (threshold, carbon row, tree row) pairs, every
+    # figure computed for all thresholds at once from one slice of the level's rows
+    carbon_rows = np.array([row for _, row, _ in pairs], dtype=np.intp)
+    tree_rows = np.array([row for _, _, row in pairs], dtype=np.intp)
+    carbon_data = dataset.carbon(level)
+    tree_data = dataset.tree(level)
 
-        if carbon_row.empty or tree_row.empty:
-            return {"error": "No data found for the specified parameters."}
+    # float64 (thresholds,) arrays, so float32 columns format exactly like the float64 they were parsed as
+    carbon_column = lambda column: carbon_data[column].to_numpy()[carbon_rows].astype(float)
+    tree_column = lambda column: tree_data[column].to_numpy()[tree_rows].astype(float)
+    extent = tree_column('extent_2000_ha')
+    gain = tree_column('gain_2000-2020_ha')
 
-        row_data = carbon_row.iloc[0]
-        tree_row_data = tree_row.iloc[0]
+    # Collect yearly data from the dense (rows x years) matrices
+    with span('yearly_extraction'):
+        series = dataset.series(level)
+        loss = series.tree_loss[tree_rows].astype(float)
+        emissions = series.emissions[carbon_rows].astype(float)
+        # Sequential sums in year order, 0 when every year is missing, as series_total
+        loss_missing = np.isnan(loss).all(axis=1)
+        emissions_missing = np.isnan(emissions).all(axis=1)
+        total_loss = np.where(loss_missing, 0.0, np.nancumsum(loss, axis=1)[:, -1])
+        total_emissions = np.where(emissions_missing, 0.0, np.nancumsum(emissions, axis=1)[:, -1])
 
-        # Collect stats
+    # Calculate analysis metrics
+    net_change = gain - total_loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = np.where(extent != 0, net_change / extent * 100, 0.0)
+
+    # Every display string in one format_values pass: the figures, then the yearly rows
+    figures = np.stack([
+        carbon_column('umd_tree_cover_extent_2000__ha'),
+        carbon_column('gfw_aboveground_carbon_stocks_2000__Mg_C'),
+        carbon_column('avg_gfw_aboveground_carbon_stocks_2000__Mg_C_ha-1'),
+        extent,
+        tree_column('extent_2010_ha'),
+        gain,
+        net_change,
+        total_emissions,
+        total_loss
+    ], axis=1)
+    count, years = figures.shape[0], len(series.years)
+    flat = [figures.ravel()]
+    units = FIGURE_UNITS * count
+    if not compact:
+        flat += [loss.ravel(), emissions.ravel()]
+        units += ['hectares'] * (count * years) + ['Mg CO₂e'] * (count * years)
+    # The compact shape drops every display string, so it skips formatting
+    texts = [None] * len(units) if compact else format_values(np.concatenate(flat), units)
+    values = figures.tolist()
+    loss_totals = [0 if missing else value for missing, value in zip(loss_missing.tolist(), total_loss.tolist())]
+    emissions_totals = [0 if missing else value for missing, value in zip(emissions_missing.tolist(), total_emissions.tolist())]
+
+    results = []
+    for i, (threshold, _, _) in enumerate(pairs):
+        (area, stocks, density, extent_2000, extent_2010, gain_2000_2020, change, _, _) = values[i]
+        text = texts[i * len(FIGURE_UNITS):(i + 1) * len(FIGURE_UNITS)]
         stats = {
-            'tree_cover_area': {
-                'value': float(row_data['umd_tree_cover_extent_2000__ha']),
-                'formatted': format_value(row_data['umd_tree_cover_extent_2000__ha'], 'hectares')
-            },
-            'carbon_stocks': {
-                'value': float(row_data['gfw_aboveground_carbon_stocks_2000__Mg_C']),
-                'formatted': format_value(row_data['gfw_aboveground_carbon_stocks_2000__Mg_C'], 'Mg C')
-            },
-            'carbon_density': {
-                'value': float(row_data['avg_gfw_aboveground_carbon_stocks_2000__Mg_C_ha-1']),
-                'formatted': format_value(row_data['avg_gfw_aboveground_carbon_stocks_2000__Mg_C_ha-1'], 'Mg C/ha')
-            },
+            'tree_cover_area': {'value': area, 'formatted': text[0]},
+            'carbon_stocks': {'value': stocks, 'formatted': text[1]},
+            'carbon_density': {'value': density, 'formatted': text[2]},
             'tree_cover_extent': {
-                '2000': {
-                    'value': float(tree_row_data['extent_2000_ha']),
-                    'formatted': format_value(tree_row_data['extent_2000_ha'], 'hectares')
-                },
-                '2010': {
-                    'value': float(tree_row_data['extent_2010_ha']),
-                    'formatted': format_value(tree_row_data['extent_2010_ha'], 'hectares')
-                }
+                '2000': {'value': extent_2000, 'formatted': text[3]},
+                '2010': {'value': extent_2010, 'formatted': text[4]}
             },
-            'tree_cover_gain_2000_2020': {
-                'value': float(tree_row_data['gain_2000-2020_ha']),
-                'formatted': format_value(tree_row_data['gain_2000-2020_ha'], 'hectares')
-            }
-        }
-        
-        # Collect yearly data
-        yearly_data = {
-            'tree_loss': {},
-            'emissions': {}
+            'tree_cover_gain_2000_2020': {'value': gain_2000_2020, 'formatted': text[5]}
         }
-        
-        total_loss = 0
-        total_emissions = 0
-        
-        for year in range(2001, 2024):
-            # Tree loss data
-            loss_col = f'tc_loss_ha_{year}'
-            loss_value = tree_row_data[loss_col]
-            if not pd.isna(loss_value):
-                total_loss += float(loss_value)
-            yearly_data['tree_loss'][str(year)] = {
-                'value': float(loss_value) if not pd.isna(loss_value) else None,
-                'formatted': format_value(loss_value, 'hectares')
+        if compact:
+            # Columnar arrays for clients that only chart the raw values
+            yearly_data = {
+                'years': series.years,
+                'tree_loss': yearly_values(loss[i]),
+                'emissions': yearly_values(emissions[i])
             }
-            
-            # Emissions data
-            emissions_col = f'gfw_forest_carbon_gross_emissions_{year}__Mg_CO2e'
-            emissions_value = row_data[emissions_col]
-            if not pd.isna(emissions_value):
-                total_emissions += float(emissions_value)
-            yearly_data['emissions'][str(year)] = {
-                'value': float(emissions_value) if not pd.isna(emissions_value) else None,
-                'formatted': format_value(emissions_value, 'Mg CO₂e')
+        else:
+            loss_start = count * len(FIGURE_UNITS) + i * years
+            emissions_start = loss_start + count * years
+            yearly_data = {
+                'tree_loss': yearly_entries(series.labels, loss[i], 'hectares', texts[loss_start:loss_start + years]),
+                'emissions': yearly_entries(series.labels, emissions[i], 'Mg CO₂e',
+                                            texts[emissions_start:emissions_start + years])
             }
-
-        # Calculate analysis metrics
-        net_change = stats['tree_cover_gain_2000_2020']['value'] - total_loss
-        net_change_percent = (net_change / stats['tree_cover_extent']['2000']['value'] * 100) if stats['tree_cover_extent']['2000']['value'] != 0 else 0
-
         analysis = {
             'net_forest_change': {
-                'value': net_change,
-                'formatted': format_value(net_change, 'hectares'),
-                'percent': round(net_change_percent, 2)
-            },
-            'total_emissions': {
-                'value': total_emissions,
-                'formatted': format_value(total_emissions, 'Mg CO₂e')
+                'value': change,
+                'formatted': text[6],
+                'percent': round(percent[i].item(), 2) if extent_2000 != 0 else 0
             },
-            'total_loss': {
-                'value': total_loss,
-                'formatted': format_value(total_loss, 'hectares')
-            },
-            'forest_health_status': 'Expansion' if net_change > 0 else 'Decline' if net_change < 0 else 'Stable'
+            'total_emissions': {'value': emissions_totals[i], 'formatted': text[7]},
+            'total_loss': {'value': loss_totals[i], 'formatted': text[8]},
+            'forest_health_status': 'Expansion' if change > 0 else 'Decline' if change < 0 else 'Stable'
         }
-
-        return {
-            'location': location if not is_country else 'India',
-            'location_type': location_type if not is_country else 'country',
-            'density_threshold': density_threshold,
+        if compact:
+            stats = without_formatted(stats)
+            analysis = without_formatted(analysis)
+        results.append({
+            'location': location,
+            'location_type': level,
+            'density_threshold': threshold,
             'stats': stats,
             'yearly_data': yearly_data,
             'analysis': analysis
-        }
+        })
+    return results
+
+def analyze_data(location=None, density_threshold=None, is_country=False, fuzzy=False, compact=False, dataset=None, entry=None):
+    try:
+        with span('dataset'):
+            if dataset is None:
+                dataset = current_dataset()
+        
+        with span('filter'):
+            if is_country:
+                level = 'country'
+                carbon_data = dataset.carbon(level)
+                tree_data = dataset.tree(level)
+                thresholds = sorted(carbon_data['umd_tree_cover_density_2000__threshold'].unique())
+                if density_threshold is None:
+                    return {'available_densities': thresholds}
+                carbon_rows = np.flatnonzero(carbon_data['umd_tree_cover_density_2000__threshold'].to_numpy() == density_threshold)
+                tree_rows = np.flatnonzero(tree_data['threshold'].to_numpy() == density_threshold)
+                if len(carbon_rows) == 0 or len(tree_rows) == 0:
+                    return {"error": "No data found for the specified parameters."}
+                carbon_offset = carbon_rows[0]
+                tree_offset = tree_rows[0]
+            else:
+                # An exact entry (a district of a given state) skips the name lookup
+                entry = entry or dataset.index.resolve(location)
+                if entry is None and fuzzy:
+                    matches = dataset.index.search(location, limit=1)
+                    entry = matches[0] if matches else None
+                if entry is None:
+                    return {"error": "Location not found in the database."}
+                level = location_type = entry.level
+
+                if density_threshold is None:
+                    return {
+                        'location': location,
+                        'location_type': location_type,
+                        'available_densities': entry.thresholds
+                    }
+                carbon_offset = entry.carbon_row(density_threshold)
+                tree_offset = entry.tree_row(density_threshold)
+                if carbon_offset is None or tree_offset is None:
+                    return {"error": "No data found for the specified parameters."}
+
+        # The sweep's builder for a single threshold, so both routes share one implementation
+        label = location if not is_country else dataset.country_name
+        return build_results(dataset, level, label, [(density_threshold, carbon_offset, tree_offset)], compact)[0]
 
     except Exception as e:
         return {"error": str(e)}
 
+def analyze_sweep(location=None, is_country=False, fuzzy=False, compact=False, dataset=None):
+    # analyze_data for every density threshold of a location, from one slice of its rows
+    dataset = dataset or current_dataset()
+    with span('filter'):
+        if is_country:
+            level = 'country'
+            carbon_thresholds = dataset.carbon(level)['umd_tree_cover_density_2000__threshold'].to_numpy()
+            tree_thresholds = dataset.tree(level)['threshold'].to_numpy()
+            pairs = []
+            for threshold in np.unique(carbon_thresholds).tolist():
+                carbon_rows = np.flatnonzero(carbon_thresholds == threshold)
+                tree_rows = np.flatnonzero(tree_thresholds == threshold)
+                if len(carbon_rows) and len(tree_rows):
+                    pairs.append((float(threshold), carbon_rows[0], tree_rows[0]))
+        else:
+            entry = dataset.index.resolve(location)
+            if entry is None and fuzzy:
+                matches = dataset.index.search(location, limit=1)
+                entry = matches[0] if matches else None
+            if entry is None:
+                return None
+            level = entry.level
+            pairs = [(float(threshold), *entry.rows(threshold)) for threshold in entry.thresholds]
+            pairs = [pair for pair in pairs if pair[1] is not None and pair[2] is not None]
+        if not pairs:
+            return None
+
+    label = location if not is_country else dataset.country_name
+    return {
+        'location': label,
+        'location_type': level,
+        'density_thresholds': [threshold for threshold, _, _ in pairs],
+        'results': build_results(dataset, level, label, pairs, compact)
+    }
+
+def serialize(result):
+    with span('serialization'):
+        return jsonify(result)
+
+def render_result(dataset, level, key, threshold, compact=False):
+    if level == 'country':
+        return serialize(analyze_data(density_threshold=threshold, is_country=True, compact=compact, dataset=dataset)).get_data(), None
+    result = analyze_data(key, threshold, compact=compact, dataset=dataset)
+    if 'error' in result:
+        return serialize(result).get_data(), None
+    # Serialize once with a placeholder so any spelling of the name can be spliced in
+    result['location'] = LOCATION_SENTINEL
+    head, tail = serialize(result).get_data().split(app.json.dumps(LOCATION_SENTINEL).encode(), 1)
+    return head, tail
+
+_result_cube_lock = threading.Lock()
+
+def materialize_results(cube):
+    try:
+        with app.app_context():
+            count = cube.materialize()
+        print(f"Materialized {count} forest data responses")
+        get_fact_index(cube.dataset)
+    except Exception as e:
+        print(f"Materialization error: {str(e)}")
+
+def get_result_cube(dataset=None, materialize=MATERIALIZE_RESULTS):
+    # One cube per loaded dataset, dropped together with it
+    dataset = dataset or current_dataset()
+    cube = dataset.derived.get('result_cube')
+    if cube is None:
+        with _result_cube_lock:
+            cube = dataset.derived.get('result_cube')
+            if cube is None:
+                cube = ResultCube(dataset, functools.partial(render_result, dataset))
+                dataset.derived['result_cube'] = cube
+                if materialize:
+                    threading.Thread(target=materialize_results, args=(cube,), daemon=True).start()
+    return cube
+
+def cube_cell(cube, location=None, density_threshold=None, is_country=False):
+    # (level, key, location) of the precomputed cell for a request, None when there is none
+    if is_country:
+        return ('country', None, None) if density_threshold in cube.country_thresholds else None
+    entry = cube.dataset.index.resolve(location)
+    if entry is not None and entry.carbon_row(density_threshold) is not None and entry.tree_row(density_threshold) is not None:
+        return entry.level, entry.key, location
+    return None
+
+def encode_location(name):
+    return app.json.dumps(name).encode()
+
+def cached_body(cube, location=None, density_threshold=None, is_country=False, compact=False):
+    cell = cube_cell(cube, location, density_threshold, is_country)
+    if cell is None:
+        return None
+    level, key, location = cell
+    return cube.body(level, key, density_threshold, location, encode=encode_location, compact=compact)
+
+def cached_encoded_body(cube, location=None, density_threshold=None, is_country=False, compact=False, encoding=None):
+    # (body, Content-Encoding or None), compressed once per cell and spelling rather than per request
+    cell = cube_cell(cube, location, density_threshold, is_country)
+    if cell is None:
+        return None
+    level, key, location = cell
+    return cube.encoded_body(level, key, density_threshold, encoding, encode_body, location, encode_location, compact)
+
+def wants_compact():
+    return request.args.get('shape') in ('compact', 'columnar')
+
+def data_response(location=None, density_threshold=None, is_country=False, fuzzy=False):
+    # Serve the precomputed body when the pair exists, otherwise run analyze_data
+    compact = wants_compact()
+    encoding = choose_encoding(request.accept_encodings)
+    cached = None if fuzzy else cached_encoded_body(get_result_cube(), location, density_threshold, is_country, compact, encoding)
+    metrics.cache_requests.inc('result_cube', 'miss' if cached is None else 'hit')
+    if cached is None:
+        return serialize(analyze_data(location, density_threshold, is_country, fuzzy, compact, current_dataset()))
+
+    # Served already compressed, compress_response only adds Vary and weakens the ETag
+    body, encoding = cached
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Bump when the body of a data route changes for the same workbook
+RESPONSE_FORMAT = 1
+DATA_MAX_AGE = int(os.getenv('FOREST_DATA_MAX_AGE', 300))
+
+def dataset_etag(dataset):
+    # Strong validator known before the body is built: workbook hash + encoder + URL
+    key = f'{dataset.version}\0{RESPONSE_FORMAT}\0{type(app.json).__name__}\0{request.full_path}'
+    return hashlib.sha256(key.encode()).hexdigest()[:40]
+
+def dataset_validators(dataset):
+    return dataset_etag(dataset), datetime.fromtimestamp(dataset.mtime / 1e9, tz=timezone.utc)
+
+def set_cache_headers(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = DATA_MAX_AGE
+    return response
+
+def dataset_versioned(view):
+    # Answer If-None-Match / If-Modified-Since from the dataset version alone
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, last_modified = dataset_validators(current_dataset())
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return set_cache_headers(app.response_class(status=304), etag, last_modified)
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            set_cache_headers(response, etag, last_modified)
+        return response
+    return wrapper
+
+BATCH_LIMIT = int(os.getenv('FOREST_BATCH_LIMIT', 2000))
+
+def expand_batch(queries, index):
+    # Returns (query, location, density, entry) tuples, {"districts": "all"} expands a state
+    # into the exact district entries of that state
+    items = []
+    for query in queries:
+        if not isinstance(query, dict):
+            raise ValueError("Each query must be an object")
+        location = query.get('location')
+        if query.get('districts') == 'all':
+            districts = index.districts_of(location)
+            if districts is None:
+                items.append((query, location, query.get('density'), None))
+            for district in districts or []:
+                items.append(({'location': district.name, 'density': query.get('density')}, district.name, query.get('density'), district))
+        else:
+            items.append((query, location, query.get('density'), None))
+    return items
+
+def shares_rows(resolved, entry, density):
+    # The cube cell for a name is only right for an exact entry when the name resolves to the same rows
+    return resolved is not None and resolved.level == entry.level and resolved.rows(density) == entry.rows(density)
+
+def batch_line(cube, query, location, density, entry=None):
+    try:
+        if density is None or isinstance(density, bool):
+            raise ValueError
+        density = float(density)
+    except (TypeError, ValueError):
+        body = jsonify({"error": "Invalid density value"}).get_data()
+    else:
+        is_country = location is None
+        body = None
+        if entry is None or shares_rows(cube.dataset.index.resolve(location), entry, density):
+            body = cached_body(cube, location, density, is_country)
+        if body is None:
+            body = serialize(analyze_data(location, density, is_country, dataset=cube.dataset, entry=entry)).get_data()
+    # Indented (debug) bodies only break lines between tokens, so joining them keeps valid JSON
+    return b'{"query":' + app.json.dumps(query).encode() + b',"result":' + body.strip().replace(b'\n', b'') + b'}'
+
+@app.route('/data/batch', methods=['POST'])
+@app.route('/data/<iso:iso>/batch', methods=['POST'])
+def batch_data():
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('queries'), list):
+            return jsonify({"error": "Expected a JSON body with a 'queries' list"}), 400
+        
+        cube = get_result_cube()
+        items = expand_batch(data['queries'], cube.dataset.index)
+        if len(items) > BATCH_LIMIT:
+            return jsonify({"error": f"Batch is limited to {BATCH_LIMIT} queries"}), 400
+        
+        stream = request.args.get('stream') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+        if stream:
+            def generate():
+                for item in items:
+                    yield batch_line(cube, *item) + b'\n'
+            return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        lines = [batch_line(cube, *item) for item in items]
+        return app.response_class(b'{"results":[' + b','.join(lines) + b']}\n', mimetype=app.json.mimetype)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/data/available-locations', methods=['GET'])
+@app.route('/data/<iso:iso>/available-locations', methods=['GET'])
+@dataset_versioned
 def get_available_locations():
     try:
-        print("Accessing available locations...") # Debug log
-        carbon_data = pd.read_excel('IND.xlsx', 
-                                  sheet_name='Subnational 2 carbon data')
+        index = current_dataset().index
         
-        states = sorted(set(str(x).lower() for x in carbon_data['state'].dropna()))
-        districts = sorted(set(str(x).lower() for x in carbon_data['district'].dropna()))
+        states = index.names('state')
+        districts = index.names('district')
         
         response = {
             'states': states,
             'districts': districts
         }
-        print(f"Found {len(states)} states and {len(districts)} districts") # Debug log
         return jsonify(response)
     except Exception as e:
         print(f"Error in get_available_locations: {str(e)}") # Debug log
         return jsonify({"error": str(e)}), 500
 
+@app.route('/data/locations/search', methods=['GET'])
+@app.route('/data/<iso:iso>/locations/search', methods=['GET'])
+@dataset_versioned
+def search_locations():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Missing search query"}), 400
+        level = request.args.get('level')
+        if level not in (None, 'state', 'district'):
+            return jsonify({"error": "Invalid location level"}), 400
+        limit = int(request.args.get('limit', 20))
+        
+        matches = current_dataset().index.search(query, level=level, limit=limit)
+        return jsonify({
+            'query': query,
+            'matches': [{'name': entry.name, 'location_type': entry.level} for entry in matches]
+        })
+    except ValueError:
+        return jsonify({"error": "Invalid limit value"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+_map_layers_lock = threading.Lock()
+
+def get_map_layers(level, dataset=None):
+    # Built once per loaded dataset, like the result cube
+    dataset = dataset or current_dataset()
+    layers = dataset.derived.get(('map_layers', level))
+    if layers is None:
+        with _map_layers_lock:
+            layers = dataset.derived.get(('map_layers', level))
+            if layers is None:
+                layers = dataset.derived[('map_layers', level)] = MapLayers(dataset, level)
+    return layers
+
+@app.route('/data/map/regions', methods=['GET'])
+@app.route('/data/<iso:iso>/map/regions', methods=['GET'])
+@dataset_versioned
+def get_map_regions():
+    try:
+        layers = get_map_layers(request.args.get('level', 'district'))
+        return jsonify({'level': layers.level, **layers.region_names()})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/data/map', methods=['GET'])
+@app.route('/data/<iso:iso>/map', methods=['GET'])
+@dataset_versioned
+def get_map_layer():
+    try:
+        args = request.args
+        metric = args.get('metric', 'loss')
+        density = float(args.get('density', 30))
+        year = int(args['year']) if args.get('year') else None
+        layers = get_map_layers(args.get('level', 'district'))
+        values = layers.layer(metric, density, year)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    if args.get('format') == 'binary':
+        # Little-endian float32 in /data/map/regions order, NaN where a region has no data
+        response = app.response_class(values.astype('<f4').tobytes(), mimetype='application/octet-stream')
+        response.headers['X-Map-Count'] = str(len(values))
+        return response
+    present = values[~np.isnan(values)]
+    return jsonify({
+        'level': layers.level,
+        'metric': metric,
+        'unit': MAP_METRICS[metric][0],
+        'year': year,
+        'density_threshold': density,
+        'count': len(values),
+        'min': float(present.min()) if len(present) else None,
+        'max': float(present.max()) if len(present) else None,
+        'values': yearly_values(values)
+    })
+
+@app.route('/data/rankings', methods=['GET'])
+@app.route('/data/<iso:iso>/rankings', methods=['GET'])
+@dataset_versioned
+def get_rankings():
+    try:
+        args = request.args
+        optional_int = lambda name: int(args[name]) if args.get(name) else None
+        result = rank(
+            current_dataset(),
+            metric=args.get('metric', 'loss'),
+            threshold=float(args.get('density', 30)),
+            level=args.get('level', 'district'),
+            state=args.get('state') or None,
+            start=optional_int('start'),
+            end=optional_int('end'),
+            top=int(args.get('top', 10)),
+            order=args.get('order', 'desc')
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/data/trends/<location>/<density>', methods=['GET'])
+@app.route('/data/<iso:iso>/trends/<location>/<density>', methods=['GET'])
+@dataset_versioned
+def get_trends(location, density):
+    try:
+        density = float(density)
+        start = int(request.args['start']) if request.args.get('start') else None
+        end = int(request.args['end']) if request.args.get('end') else None
+        window = int(request.args.get('window', 3))
+        if window < 1:
+            raise ValueError("window must be positive")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        dataset = current_dataset()
+        is_country = location.lower() in ('country', dataset.country_name.lower())
+        located = locate_rows(dataset, location, density, is_country)
+        if located is None:
+            return jsonify({"error": "No data found for the specified parameters."}), 404
+        level, carbon_offset, tree_offset = located
+        tables = dataset.trends(level)
+        return jsonify({
+            'location': location if not is_country else dataset.country_name,
+            'location_type': level,
+            'density_threshold': density,
+            'window': window,
+            'tree_loss': trend_series(tables['tree_loss'], tree_offset, start, end, window),
+            'emissions': trend_series(tables['emissions'], carbon_offset, start, end, window)
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/data/sweep/<location>', methods=['GET'])
+@app.route('/data/<iso:iso>/sweep/<location>', methods=['GET'])
+@dataset_versioned
+def get_threshold_sweep(location):
+    # Every density threshold of a location in one response, instead of densities + one call per threshold
+    try:
+        dataset = current_dataset()
+        is_country = location.lower() in ('country', dataset.country_name.lower())
+        result = analyze_sweep(location, is_country, request.args.get('match') == 'fuzzy', wants_compact(), dataset)
+        if result is None:
+            return jsonify({"error": "No data found for the specified parameters."}), 404
+        return serialize(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/data/countries', methods=['GET'])
+def get_countries():
+    try:
+        resident = resident_countries()
+        return jsonify({
+            'default': DEFAULT_ISO,
+            'countries': [{'iso': iso, 'loaded': iso in resident} for iso in available_countries()]
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/')
 def home():
     return jsonify({
@@ -242,53 +852,68 @@ def home():
         "version": "1.0",
         "endpoints": {
             "root": "/",
+            "countries": "/data/countries",
+            "country_data": "/data/<iso>/country/<density>",
+            "country_scoped": "/data/<iso>/... (every /data route, e.g. /data/IND/state/<state_name>/<density>)",
             "available_locations": "/data/available-locations",
+            "location_search": "/data/locations/search?q=<text>&level=<state|district>",
             "state_data": "/data/state/<state_name>/<density>",
             "district_data": "/data/district/<district_name>/<density>",
             "india_data": "/data/india/<density>",
             "densities": "/data/densities?location=<location>",
-            "analyze": "/data/analyze/<location>/<density>"
+            "analyze": "/data/analyze/<location>/<density>",
+            "batch": "POST /data/batch",
+            "map_regions": "/data/map/regions?level=<state|district>",
+            "map": "/data/map?metric=<metric>&year=<year>&density=<density>&level=<state|district>&format=<json|binary>",
+            "trends": "/data/trends/<location>/<density>?start=<year>&end=<year>&window=<years>",
+            "threshold_sweep": "/data/sweep/<location>",
+            "rankings": "/data/rankings?metric=<loss|emissions|carbon_stocks|net_change|percent_change>&state=<state>&start=<year>&end=<year>&density=<density>&top=<k>",
+            "metrics": "/metrics"
         }
     })
 
 @app.route('/data/state/<state_name>/<density>', methods=['GET'])
+@app.route('/data/<iso:iso>/state/<state_name>/<density>', methods=['GET'])
+@dataset_versioned
 def get_state_data(state_name, density):
     try:
         density = float(density)
-        result = analyze_data(state_name, density)
-        return jsonify(result)
+        return data_response(state_name, density, fuzzy=request.args.get('match') == 'fuzzy')
     except ValueError:
         return jsonify({"error": "Invalid density value"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/data/district/<district_name>/<density>', methods=['GET'])
+@app.route('/data/<iso:iso>/district/<district_name>/<density>', methods=['GET'])
+@dataset_versioned
 def get_district_data(district_name, density):
     try:
         density = float(density)
-        result = analyze_data(district_name, density)
-        return jsonify(result)
+        return data_response(district_name, density, fuzzy=request.args.get('match') == 'fuzzy')
     except ValueError:
         return jsonify({"error": "Invalid density value"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/data/india/<density>', methods=['GET'])
+@app.route('/data/<iso:iso>/country/<density>', methods=['GET'])
+@dataset_versioned
 def get_india_data(density):
     try:
         density = float(density)
-        result = analyze_data(density_threshold=density, is_country=True)
-        return jsonify(result)
+        return data_response(density_threshold=density, is_country=True)
     except ValueError:
         return jsonify({"error": "Invalid density value"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/data/densities', methods=['GET'])
+@app.route('/data/<iso:iso>/densities', methods=['GET'])
+@dataset_versioned
 def get_available_densities():
     try:
         location = request.args.get('location')
-        print(f"Getting densities for location: {location}")
         if location:
             result = analyze_data(location)
         else:
@@ -303,19 +928,8 @@ def get_available_densities():
         print(f"Error in get_available_densities: {str(e)}")  # Debug log
         return jsonify({"error": str(e)}), 500
     
-@app.route('/data/analyze/<location>/<density>', methods=['GET'])
-def analyze_location_data(location, density):
-    try:
-        # Get forest data
-        forest_data = analyze_data(location, float(density))
-        if isinstance(forest_data, str) or 'error' in forest_data:
-            return jsonify({"error": "Could not retrieve forest data"}), 404
-
-        # Analyze trends
-        trends = analyze_trends(forest_data)
-        
-        # Prepare data for AI analysis
-        analysis_prompt = f'''
+def build_location_analysis_prompt(location, forest_data, trends):
+    return f'''
         Analyze this forest data for {location}:
         - Current forest cover: {forest_data['stats']['tree_cover_area']['formatted']}
         - Carbon stocks: {forest_data['stats']['carbon_stocks']['formatted']}
@@ -331,23 +945,79 @@ def analyze_location_data(location, density):
         
         Keep the language simple and conversational.
         '''
+
+def location_analysis(location, density_threshold, dataset=None):
+    # (forest_data, trends, prompt) for a pair, None when it has no data
+    dataset = dataset or current_dataset()
+    forest_data = analyze_data(location, density_threshold, dataset=dataset)
+    if isinstance(forest_data, str) or 'error' in forest_data:
+        return None
+    trends = analyze_trends(forest_data, dataset)
+    # The canonical name keeps every spelling of a location on one prompt, so they share one answer
+    entry = dataset.index.resolve(location)
+    name = entry.name if entry is not None else location
+    return forest_data, trends, build_location_analysis_prompt(name, forest_data, trends)
+
+# Most-requested (location, density) pairs, optionally re-generated in the background
+analysis_demand = DemandTracker()
+
+def warm_analysis(iso, location, density_threshold):
+    try:
+        dataset = get_country(iso)
+    except UnknownCountryError:
+        # The workbook was removed after the demand was recorded
+        return False
+    analysis = location_analysis(location, density_threshold, dataset)
+    if analysis is None:
+        return False
+    _, status = generate_text(analysis[2], 'background')
+    return status == MISS
+
+PREWARM_TOP = int(os.getenv('LLM_PREWARM_TOP', 0))
+prewarmer = Prewarmer(analysis_demand, warm_analysis, top_n=PREWARM_TOP,
+                      interval=float(os.getenv('LLM_PREWARM_INTERVAL', 600)))
+def location_analysis_request(location, density, iso, dataset=None):
+    # Everything /data/analyze does before the model call, shared with asgi.py:
+    # the prompt and the structured part of the answer
+    density = float(density)
+    analysis = location_analysis(location, density, dataset)
+    if analysis is None:
+        raise RequestError("Could not retrieve forest data", 404)
+    forest_data, trends, analysis_prompt = analysis
+    analysis_demand.record(iso, location.lower(), density)
+    return analysis_prompt, {
+        'location': location,
+        'forest_data': forest_data,
+        'trends': trends
+    }
+
+def location_analysis_payload(data, summary):
+    # Combine all data
+    return {**data, 'ai_analysis': {
+        'summary': summary,
+        'timestamp': datetime.now().isoformat()
+    }}
+
+@app.route('/data/analyze/<location>/<density>', methods=['GET'])
+@app.route('/data/<iso:iso>/analyze/<location>/<density>', methods=['GET'])
+def analyze_location_data(location, density):
+    try:
+        analysis_prompt, data = location_analysis_request(location, density, g.get('iso', DEFAULT_ISO))
         
-        # Get AI analysis
-        ai_response = model.generate_content(analysis_prompt)
+        if wants_event_stream():
+            return event_stream(analysis_prompt, ('data', data), 'analysis')
         
-        # Combine all data
-        complete_analysis = {
-            'location': location,
-            'forest_data': forest_data,
-            'trends': trends,
-            'ai_analysis': {
-                'summary': ai_response.text,
-                'timestamp': datetime.now().isoformat()
-            }
-        }
+        # Get AI analysis
+        summary, cache_status = generate_text(analysis_prompt, 'analysis')
         
-        return jsonify(complete_analysis)
+        response = jsonify(location_analysis_payload(data, summary))
+        response.headers['X-LLM-Cache'] = cache_status
+        return response
         
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    except OverloadedError as e:
+        return overloaded(e)
     except Exception as e:
         print(f"Analysis error: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -362,20 +1032,12 @@ def extract_location_from_data(data):
 
 def analyze_forest_trends(data):
     try:
-        yearly_data = data.get('yearly_data', {})
-        tree_loss = yearly_data.get('tree_loss', {})
-        emissions = yearly_data.get('emissions', {})
-        
-        # Calculate recent trends
-        recent_years = sorted(tree_loss.keys())[-5:]  # Last 5 years
-        recent_loss = [float(tree_loss[year]['value']) for year in recent_years if tree_loss[year]['value'] is not None]
-        recent_emissions = [float(emissions[year]['value']) for year in recent_years if emissions[year]['value'] is not None]
-        
+        loss, emissions = recent_trends(data)
         return {
-            'average_annual_loss': sum(recent_loss) / len(recent_loss) if recent_loss else 0,
-            'average_annual_emissions': sum(recent_emissions) / len(recent_emissions) if recent_emissions else 0,
-            'trend': 'increasing' if recent_loss[-1] > recent_loss[0] else 'decreasing' if recent_loss else 'stable',
-            'years_analyzed': recent_years
+            'average_annual_loss': optional_float(loss['mean']) or 0,
+            'average_annual_emissions': optional_float(emissions['mean']) or 0,
+            'trend': direction(loss['slope']),
+            'years_analyzed': [str(year) for year in range(loss['years'][0], loss['years'][1] + 1)]
         }
     except Exception as e:
         print(f"Trend analysis error: {str(e)}")
@@ -413,17 +1075,8 @@ def get_sdg_context(forest_data, trends):
     return context
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_forest_data():
-    try:
-        data = request.json
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-            
-        location = data.get('location', 'the specified region')
-        
-        # Create analysis prompt
-        analysis_prompt = f'''
+def build_forest_analysis_prompt(location, data):
+    return f'''
         Based on the forest data for {location}, provide a natural, conversational analysis in simple English. Include:
 
         Current Situation:
@@ -447,49 +1100,44 @@ def analyze_forest_data():
 
         Format the response as a continuous narrative, avoiding technical jargon. Don't use bullet points or numbered lists.
         '''
-        
-        # Get AI analysis
-        ai_response = model.generate_content(analysis_prompt)
-        
-        return jsonify({
-            'analysis': ai_response.text
-        })
-        
-    except Exception as e:
-        print(f"Analysis error: {str(e)}")
-        return jsonify({"error": str(e)}), 500
 
-@app.route('/api/chat', methods=['POST', 'GET'])
-def chat_interaction():
-    try:
-        # First try to get message from query parameters
-        message = request.args.get('message', '')
-        
-        # If no message in query params, try request body
-        if not message:
-            if request.is_json:
-                message = request.json.get('message', '')
-            else:
-                message = request.get_data(as_text=True)
-        
-        # Clean up the message
-        message = message.strip('"').strip()
-        
-        if not message:
-            return "Please provide a question either as a query parameter or in the request body", 400
+_fact_index_lock = threading.Lock()
+
+def get_fact_index(dataset=None):
+    # Built once per loaded dataset, like the result cube
+    dataset = dataset or current_dataset()
+    index = dataset.derived.get('facts')
+    if index is None:
+        with _fact_index_lock:
+            index = dataset.derived.get('facts')
+            if index is None:
+                index = dataset.derived['facts'] = FactIndex(dataset)
+    return index
+
+def location_context(message):
+    # Whatever follows "in", the hint chat prompts carried before the fact index
+    match = re.search(r'\bin\b(.+)', message.lower())
+    return match.group(1).strip() if match else None
 
-        # Extract location from message
-        location = None
-        if "in" in message.lower():
-            parts = message.lower().split("in")
-            if len(parts) > 1:
-                location = parts[1].strip()
+def build_chat_prompt(message, dataset=None):
+    # Ground the answer in the dataset's figures for the places the question names
+    try:
+        with span('retrieval'):
+            facts = get_fact_index(dataset).lookup(message)
+    except Exception as e:
+        print(f"Fact lookup error: {str(e)}")
+        facts = []
+    context = ''
+    if facts:
+        context = "Global Forest Watch data (use these figures, do not invent others):\n" + '\n'.join(f"        - {fact}" for fact in facts)
+    elif location := location_context(message):
+        context = f"Location Context: {location}"
 
-        chat_prompt = f'''
+    return f'''
         As a sustainable development expert focusing on forest conservation:
         
         User Question: {message}
-        {f"Location Context: {location}" if location else ""}
+        {context}
         
         Provide a helpful response that:
         1. Addresses the question directly
@@ -500,14 +1148,158 @@ def chat_interaction():
         
         Keep the response conversational and easy to understand.
         '''
+
+def forest_analysis_request(data):
+    # The /api/analyze prompt for a posted body, shared with asgi.py
+    if not data:
+        raise RequestError("No data provided")
+    location = data.get('location', 'the specified region')
+    return build_forest_analysis_prompt(location, data)
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze_forest_data():
+    try:
+        # Create analysis prompt
+        analysis_prompt = forest_analysis_request(request.json)
         
-        response = model.generate_content(chat_prompt)
-        return response.text
+        if wants_event_stream():
+            return event_stream(analysis_prompt, priority='report')
         
+        # Get AI analysis
+        analysis, cache_status = generate_text(analysis_prompt, 'report')
+        
+        response = jsonify({
+            'analysis': analysis
+        })
+        response.headers['X-LLM-Cache'] = cache_status
+        return response
+        
+    except RequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    except OverloadedError as e:
+        return overloaded(e)
+    except Exception as e:
+        print(f"Analysis error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+CHAT_ERROR_TEXT = "Sorry, there was an error processing your question. Please try again."
+
+def chat_message(message, body, is_json):
+    # The question from ?message=, else from the JSON or plain-text body; shared with asgi.py
+    if not message:
+        if is_json:
+            message = json.loads(body or b'{}').get('message', '')
+        else:
+            message = body.decode(errors='replace')
+    
+    # Clean up the message
+    message = message.strip('"').strip()
+    
+    if not message:
+        raise RequestError("Please provide a question either as a query parameter or in the request body")
+    return message
+
+@app.route('/api/chat', methods=['POST', 'GET'])
+def chat_interaction():
+    try:
+        message = chat_message(request.args.get('message', ''), request.get_data(), request.is_json)
+        chat_prompt = build_chat_prompt(message)
+        
+        if wants_event_stream():
+            return event_stream(chat_prompt)
+        
+        text, cache_status = generate_text(chat_prompt)
+        return text, 200, {'X-LLM-Cache': cache_status}
+        
+    except RequestError as e:
+        return str(e), e.status
+    except OverloadedError as e:
+        return overloaded(e, text=True)
     except Exception as e:
         print(f"Chat error: {str(e)}")
-        return "Sorry, there was an error processing your question. Please try again.", 500
+        return CHAT_ERROR_TEXT, 500
+
+
+
+# Background jobs rebuild what requests read: reloaded workbooks and their derived structures,
+# pre-generated analyses and news for the hottest locations
+JOBS_ENABLED = os.getenv('FOREST_JOBS', '1') == '1'
+DATASET_REFRESH_INTERVAL = float(os.getenv('FOREST_RELOAD_INTERVAL', 30))
+NEWS_REFRESH_INTERVAL = float(os.getenv('NEWS_REFRESH_INTERVAL', 900))
+NEWS_REFRESH_TOP = int(os.getenv('NEWS_REFRESH_TOP', 10))
+jobs = JobQueue(os.getenv('FOREST_JOBS_DB', os.path.join(CACHE_DIR, 'jobs.db')),
+                workers=int(os.getenv('FOREST_JOB_WORKERS', 2)))
+
+def build_derived(dataset):
+    cube = get_result_cube(dataset, materialize=False)
+    if MATERIALIZE_RESULTS and not cube.materialized:
+        with app.app_context():
+            cube.materialize()
+    for level in MAP_LEVELS:
+        get_map_layers(level, dataset)
+    get_fact_index(dataset)
 
+def refresh_datasets():
+    # Reload workbooks that changed on disk, then build everything requests read from them
+    available_countries(refresh=True)
+    reloaded = []
+    for path in resident_paths():
+        previous = get_dataset(path, reload=False)
+        dataset = get_dataset(path, reload=True)
+        if dataset is not previous:
+            reloaded.append(os.path.basename(path))
+        build_derived(dataset)
+    return {'reloaded': reloaded}
+
+def refresh_news():
+    locations = list(dict.fromkeys(location for _, location, _ in analysis_demand.top(NEWS_REFRESH_TOP * 4)))
+    for location in locations[:NEWS_REFRESH_TOP]:
+        search_news(location, refresh=True)
+    return len(locations[:NEWS_REFRESH_TOP])
+
+jobs.register('refresh_datasets', refresh_datasets, every=DATASET_REFRESH_INTERVAL, local=True)
+jobs.register('prewarm_analyses', prewarmer.run_once, every=prewarmer.interval if PREWARM_TOP > 0 else None, local=True)
+jobs.register('refresh_news', refresh_news, every=NEWS_REFRESH_INTERVAL if SEARCH_KEY else None, local=True)
+
+_background_lock = threading.Lock()
+_background_pid = None
+
+def start_background():
+    # Runs on each process's first request, not at import: pre-fork workers get their own threads
+    # (threads do not survive fork) and importing the app from a script starts nothing
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid != os.getpid():
+            if JOBS_ENABLED:
+                reload_on_request(False)
+                jobs.start()
+            elif PREWARM_TOP > 0:
+                prewarmer.start()
+            _background_pid = os.getpid()
+
+@app.before_request
+def start_background_on_first_request():
+    start_background()
+
+@app.route('/admin/jobs', methods=['GET'])
+def get_jobs():
+    try:
+        return jsonify({'enabled': JOBS_ENABLED, **jobs.status(int(request.args.get('recent', 20)))})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/memory', methods=['GET'])
+def get_memory():
+    # Per-sheet footprint of every resident dataset; mapped bytes are shared by all workers
+    try:
+        return jsonify({
+            iso: memory_report(get_country(iso))
+            for iso in sorted(resident_countries())
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+# ASGI entry point: uvicorn asgi:application
+# The Gemini-backed routes run natively on the event loop, so a slow completion
+# no longer pins a worker thread. Everything else is served by the Flask app.
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+
+import app as forest
+from core import BUSY_TEXT, overloaded_payload
+from llm_limiter import OverloadedError
+import metrics
+
+# pandas/NumPy work is CPU-bound, keep it off the event loop in a bounded pool
+CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', 4))
+executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='forest-cpu')
+
+flask_application = WsgiToAsgi(forest.app)
+
+ANALYZE_ROUTE = re.compile(r'^/data/(?:([A-Za-z]{3})/)?analyze/([^/]+)/([^/]+)$')
+
+CORS_HEADERS = [(b'access-control-allow-origin', forest.CORS_ORIGINS.encode())]
+
+
+async def run_cpu(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+async def generate_text(prompt, priority='chat'):
+    # app.generate_text on the event loop, with the cache's SQLite reads and writes in the pool
+    return await forest.llm_cache.agenerate(forest.model, forest.MODEL_NAME, prompt, priority, run=run_cpu)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, body, content_type, headers=None):
+    if isinstance(body, str):
+        body = body.encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+                   + CORS_HEADERS + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload, headers=None):
+    await send_response(send, status, forest.app.json.dumps(payload, separators=(',', ':')) + '\n', 'application/json', headers)
+
+
+async def send_overloaded(send, error, text=False):
+    headers = {'Retry-After': str(error.retry_after)}
+    if text:
+        return await send_response(send, 503, BUSY_TEXT, 'text/html; charset=utf-8', headers)
+    await send_json(send, 503, overloaded_payload(error), headers)
+
+
+async def send_event_stream(send, prompt, first_event=None, priority='chat'):
+    # Slot first, as in app.event_stream, so overload is answered with a 503 rather than an error event
+    chunks = await forest.llm_cache.astream(forest.model, forest.MODEL_NAME, prompt, priority, run=run_cpu)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')] + CORS_HEADERS
+    })
+
+    async def emit(event, data):
+        await send({'type': 'http.response.body', 'body': forest.sse(event, data).encode(), 'more_body': True})
+
+    if first_event is not None:
+        await emit(*first_event)
+    status = None
+    try:
+        async for text, status in chunks:
+            await emit('token', {'text': text})
+        await emit('done', {'timestamp': datetime.now().isoformat(), 'cache': status})
+    except Exception as e:
+        print(f"Streaming error: {str(e)}")
+        await emit('error', {'error': str(e)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def wants_event_stream(scope, query):
+    accept = dict(scope['headers']).get(b'accept', b'').decode()
+    return query.get('stream', [''])[0] in ('1', 'true', 'sse') or 'text/event-stream' in accept
+
+
+# The views below mirror those in app.py: validation and payloads come from there, only the awaits differ
+async def analyze_location_data(scope, send, query, iso, location, density):
+    iso = (iso or forest.DEFAULT_ISO).upper()
+    try:
+        dataset = await run_cpu(forest.country_dataset, iso)
+        analysis_prompt, data = await run_cpu(forest.location_analysis_request, location, density, iso, dataset)
+
+        if wants_event_stream(scope, query):
+            return await send_event_stream(send, analysis_prompt, ('data', data), 'analysis')
+
+        summary, cache_status = await generate_text(analysis_prompt, 'analysis')
+        await send_json(send, 200, forest.location_analysis_payload(data, summary), {'X-LLM-Cache': cache_status})
+    except forest.UnknownCountryError:
+        await send_json(send, 404, forest.unknown_country(iso))
+    except forest.RequestError as e:
+        await send_json(send, e.status, {"error": str(e)})
+    except OverloadedError as e:
+        await send_overloaded(send, e)
+    except Exception as e:
+        print(f"Analysis error: {str(e)}")
+        await send_json(send, 500, {"error": str(e)})
+
+
+async def analyze_forest_data(scope, send, query, body):
+    try:
+        analysis_prompt = forest.forest_analysis_request(json.loads(body) if body else None)
+
+        if wants_event_stream(scope, query):
+            return await send_event_stream(send, analysis_prompt, priority='report')
+
+        analysis, cache_status = await generate_text(analysis_prompt, 'report')
+        await send_json(send, 200, {'analysis': analysis}, {'X-LLM-Cache': cache_status})
+    except forest.RequestError as e:
+        await send_json(send, e.status, {"error": str(e)})
+    except OverloadedError as e:
+        await send_overloaded(send, e)
+    except Exception as e:
+        print(f"Analysis error: {str(e)}")
+        await send_json(send, 500, {"error": str(e)})
+
+
+async def chat_interaction(scope, send, query, body):
+    try:
+        content_type = dict(scope['headers']).get(b'content-type', b'').decode()
+        message = forest.chat_message(query.get('message', [''])[0], body, content_type.startswith('application/json'))
+        chat_prompt = await run_cpu(forest.build_chat_prompt, message)
+
+        if wants_event_stream(scope, query):
+            return await send_event_stream(send, chat_prompt)
+
+        text, cache_status = await generate_text(chat_prompt)
+        await send_response(send, 200, text, 'text/html; charset=utf-8', {'X-LLM-Cache': cache_status})
+    except forest.RequestError as e:
+        await send_response(send, e.status, str(e), 'text/html; charset=utf-8')
+    except OverloadedError as e:
+        await send_overloaded(send, e, text=True)
+    except Exception as e:
+        print(f"Chat error: {str(e)}")
+        await send_response(send, 500, forest.CHAT_ERROR_TEXT, 'text/html; charset=utf-8')
+
+
+async def timed(route, method, send, handler):
+    # Native routes bypass Flask's request hooks, so record their latency here
+    started = time.perf_counter()
+    status = []
+
+    async def tracking_send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        await send(message)
+
+    try:
+        await handler(tracking_send)
+    finally:
+        metrics.request_duration.observe(time.perf_counter() - started, route, method,
+                                         str(status[0] if status else 500))
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        forest.start_background()
+        path = scope['path']
+        method = scope['method']
+        query = parse_qs(scope.get('query_string', b'').decode())
+
+        match = ANALYZE_ROUTE.match(path)
+        if match and method == 'GET':
+            route = '/data/<iso:iso>/analyze/<location>/<density>' if match.group(1) else '/data/analyze/<location>/<density>'
+            return await timed(route, method, send,
+                               lambda send: analyze_location_data(scope, send, query, *match.groups()))
+        if path == '/api/analyze' and method == 'POST':
+            body = await read_body(receive)
+            return await timed(path, method, send, lambda send: analyze_forest_data(scope, send, query, body))
+        if path == '/api/chat' and method in ('GET', 'POST'):
+            body = await read_body(receive)
+            return await timed(path, method, send, lambda send: chat_interaction(scope, send, query, body))
+
+    await flask_application(scope, receive, send)
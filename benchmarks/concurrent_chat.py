@@ -0,0 +1,93 @@
+# Concurrent /api/chat throughput: gunicorn sync workers vs the ASGI entry point.
+# Gemini is replaced by a stub that sleeps STUB_LLM_DELAY seconds per call.
+# Usage: python benchmarks/concurrent_chat.py [concurrency] [requests]
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def run_load(base_url, concurrency, total):
+    session_per_thread = {}
+
+    def one(i):
+        session = session_per_thread.setdefault(i % concurrency, requests.Session())
+        start = time.perf_counter()
+        response = session.post(f'{base_url}/api/chat', json={'message': f'How are the forests doing, question {i}?'}, timeout=120)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests_per_sec': total / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1e3,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1e3
+    }
+
+
+def serve(command, port):
+    env = dict(os.environ, FOREST_MATERIALIZE='0', FOREST_JOBS='0')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(f'http://127.0.0.1:{port}/')
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    workers = os.getenv('BENCH_WORKERS', '2')
+    print(f"{total} chats, {concurrency} concurrent, stub LLM delay {os.getenv('STUB_LLM_DELAY', '0.5')}s, {workers} workers")
+
+    setups = {
+        'gunicorn sync (before)': lambda port: [
+            sys.executable, '-m', 'gunicorn', '--pythonpath', f'{ROOT},{BENCHMARKS}',
+            '-w', workers, '-b', f'127.0.0.1:{port}', 'stub_app:app'
+        ],
+        'uvicorn asgi (after)': lambda port: [
+            sys.executable, '-m', 'uvicorn', '--app-dir', BENCHMARKS, '--workers', workers,
+            '--port', str(port), '--log-level', 'warning', 'stub_app:application'
+        ]
+    }
+    for label, command in setups.items():
+        port = free_port()
+        process = serve(command(port), port)
+        try:
+            result = run_load(f'http://127.0.0.1:{port}', concurrency, total)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{label:<24} {result['requests_per_sec']:8.1f} req/s  p50 {result['p50_ms']:8.0f} ms  p95 {result['p95_ms']:8.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Offline consistency checks of the precomputed and batched data paths against the workbook rows.
+# Usage: python benchmarks/consistency.py
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import app as forest  # noqa: E402
+from location_index import normalize  # noqa: E402
+
+
+def check_batch_districts(client, dataset, density=30):
+    # Every district of a {"districts": "all"} batch must carry the figures of a row of that state
+    tree = dataset.tree('district')
+    rows = {}
+    for state, district, threshold, extent in zip(tree['state'], tree['district'], tree['threshold'], tree['extent_2000_ha']):
+        if threshold == density:
+            rows.setdefault((normalize(state), normalize(district)), set()).add(float(extent))
+
+    checked = 0
+    for state in dataset.index.names('state'):
+        response = client.post('/data/batch', json={'queries': [{'location': state, 'districts': 'all', 'density': density}]})
+        for line in response.get_json()['results']:
+            district = line['query']['location']
+            result = line['result']
+            if 'error' in result:
+                continue
+            extent = result['stats']['tree_cover_extent']['2000']['value']
+            assert extent in rows.get((state, normalize(district)), ()), (state, district, extent)
+            checked += 1
+    print(f"batch districts: {checked} results, all from rows of the requested state")
+
+
+def check_facts(dataset, density=30.0):
+    # Every chat fact snippet must quote the extent of the row named exactly as the snippet's place
+    extents = {}
+    for level in ('state', 'district'):
+        tree = dataset.tree(level)
+        states = tree['state'] if level == 'district' else tree[level]
+        for state, name, threshold, extent in zip(states, tree[level], tree['threshold'], tree['extent_2000_ha']):
+            if threshold == density:
+                extents.setdefault((level, normalize(state), normalize(name)), float(extent))
+
+    checked = 0
+    for snippets in forest.get_fact_index(dataset).facts(density).values():
+        for snippet in snippets:
+            place = snippet.split(', canopy')[0]
+            figure = re.search(r': ([\d,]+) ha tree cover in 2000', snippet)
+            if place == dataset.country_name or figure is None:
+                continue
+            if place.endswith(' state'):
+                key = ('state', normalize(place[:-len(' state')]), normalize(place[:-len(' state')]))
+            else:
+                name, state = place.rsplit(' district, ', 1)
+                key = ('district', normalize(state), normalize(name))
+            assert f"{extents[key]:,.0f}" == figure.group(1), (snippet, extents.get(key))
+            checked += 1
+    print(f"chat facts: {checked} snippets, all from the row named exactly as their place")
+
+
+def check_sweep(dataset):
+    # Every sweep result must equal analyze_data at that threshold, in both shapes
+    locations = [(key, False) for level in ('state', 'district') for key in dataset.index.names(level)]
+    checked = 0
+    for compact in (False, True):
+        for location, is_country in locations + [(None, True)]:
+            sweep = forest.analyze_sweep(location, is_country, compact=compact, dataset=dataset)
+            for threshold, result in zip(sweep['density_thresholds'], sweep['results']):
+                expected = forest.analyze_data(location, threshold, is_country, compact=compact, dataset=dataset)
+                assert result == expected, (location, threshold, compact)
+                checked += 1
+    print(f"threshold sweep: {checked} results, all equal to analyze_data")
+
+
+def main():
+    dataset = forest.get_dataset()
+    client = forest.app.test_client()
+    check_batch_districts(client, dataset)
+    check_facts(dataset)
+    check_sweep(dataset)
+
+
+if __name__ == '__main__':
+    main()
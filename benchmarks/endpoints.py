@@ -0,0 +1,186 @@
+# Offline benchmark of the data endpoints and the analyze_data hot path.
+# Gemini and Custom Search are replaced by stubs, so no network or API keys are needed.
+# Usage:
+#   python benchmarks/endpoints.py --output bench.json
+#   python benchmarks/endpoints.py --output new.json --compare bench.json
+# --compare exits non-zero when any p50 regressed by more than --threshold.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+# No background rebuilds while measuring
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import app as forest
+import dataset
+from stubs import FakeModel, FakeSearchClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': total / len(samples) * 1e3,
+        'p50_ms': percentile(samples, 50) * 1e3,
+        'p90_ms': percentile(samples, 90) * 1e3,
+        'p99_ms': percentile(samples, 99) * 1e3,
+        'max_ms': samples[-1] * 1e3,
+        'requests_per_sec': len(samples) / total if total else None
+    }
+
+
+def measure(func, iterations, warmup=3):
+    for _ in range(warmup):
+        func(0)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def endpoint_benchmarks(client, index, iterations):
+    states = index.names('state')
+    districts = index.names('district')
+    thresholds = [0, 10, 15, 20, 25, 30, 50, 75]
+
+    def get(path_for):
+        def run(i):
+            response = client.get(path_for(i))
+            if response.status_code >= 500:
+                raise RuntimeError(f"{path_for(i)} returned {response.status_code}")
+            response.get_data()
+        return run
+
+    routes = {
+        '/data/state': lambda i: f'/data/state/{states[i % len(states)]}/{thresholds[i % len(thresholds)]}',
+        '/data/district': lambda i: f'/data/district/{districts[i % len(districts)]}/{thresholds[i % len(thresholds)]}',
+        '/data/india': lambda i: f'/data/india/{thresholds[i % len(thresholds)]}',
+        '/data/densities': lambda i: f'/data/densities?location={states[i % len(states)]}',
+        '/data/available-locations': lambda i: '/data/available-locations',
+        '/data/analyze': lambda i: f'/data/analyze/{states[i % len(states)]}/{thresholds[i % len(thresholds)]}'
+    }
+    return {route: measure(get(path_for), iterations) for route, path_for in routes.items()}
+
+
+def phase_benchmarks(index, iterations, include_excel):
+    phases = {}
+    current = dataset.get_dataset()
+
+    if include_excel:
+        phases['workbook_load_excel'] = measure(lambda i: dataset.parse_workbook(current.path), 3, warmup=0)
+    phases['workbook_load_cache'] = measure(lambda i: dataset.read_cache(current.version), 20, warmup=1)
+
+    pairs = [(key, float(t)) for key in index.names('district') for t in index.get('district', key).thresholds]
+
+    def resolve(i):
+        key, threshold = pairs[i % len(pairs)]
+        entry = index.resolve(key)
+        return entry.carbon_row(threshold), entry.tree_row(threshold)
+
+    phases['filter'] = measure(resolve, iterations * 10)
+
+    series = current.series('district')
+
+    def extract(i):
+        carbon_offset, tree_offset = resolve(i)
+        loss = series.tree_loss[tree_offset].astype(float)
+        emissions = series.emissions[carbon_offset].astype(float)
+        forest.yearly_entries(series.labels, loss, 'hectares')
+        forest.yearly_entries(series.labels, emissions, 'Mg CO₂e')
+        forest.series_total(loss)
+        forest.series_total(emissions)
+
+    phases['yearly_extraction'] = measure(extract, iterations * 10)
+
+    results = [forest.analyze_data(*pairs[i % len(pairs)]) for i in range(64)]
+    trend_inputs = [forest.analyze_data(key, t) for key, t in pairs[:512]]
+    with forest.app.app_context():
+        phases['json_serialization'] = measure(lambda i: forest.jsonify(results[i % len(results)]).get_data(), iterations * 10)
+
+    phases['analyze_data'] = measure(lambda i: forest.analyze_data(*pairs[i % len(pairs)]), iterations * 10)
+    phases['analyze_trends'] = measure(lambda i: forest.analyze_trends(trend_inputs[i % len(trend_inputs)]), iterations * 10)
+    phases['format_value'] = measure(lambda i: forest.format_value(1234567.891 * (i + 1), 'hectares'), iterations * 10)
+    return phases
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline.get('revision')}), p50 change:")
+    regressions = 0
+    for section in ('endpoints', 'phases'):
+        for name, stats in current[section].items():
+            old = baseline.get(section, {}).get(name)
+            if not old:
+                continue
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0
+            flag = '  REGRESSION' if change > threshold else ''
+            regressions += bool(flag)
+            print(f"  {name:<28} {old['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the forest data API offline')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 slowdown that counts as a regression')
+    parser.add_argument('--skip-excel', action='store_true', help='skip the slow openpyxl parse phase')
+    args = parser.parse_args()
+
+    forest.model = FakeModel()
+    forest.search_client = FakeSearchClient()
+    forest.llm_cache.max_entries = 0
+    client = forest.app.test_client()
+    index = dataset.get_dataset().index
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'iterations': args.iterations,
+        'endpoints': endpoint_benchmarks(client, index, args.iterations),
+        'phases': phase_benchmarks(index, args.iterations, not args.skip_excel)
+    }
+
+    for section in ('endpoints', 'phases'):
+        print(f"\n{section}")
+        for name, stats in results[section].items():
+            print(f"  {name:<28} p50 {stats['p50_ms']:9.3f} ms  p99 {stats['p99_ms']:9.3f} ms  "
+                  f"{stats['requests_per_sec']:10.1f} /s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Traffic spike of distinct chats against the stub model: python benchmarks/llm_overload.py
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+# No background rebuilds while measuring
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import app as forest  # noqa: E402
+from llm_limiter import LLMScheduler  # noqa: E402
+from stubs import FakeModel  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--queue-depth', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--delay', type=float, default=0.5)
+    args = parser.parse_args()
+
+    forest.model = FakeModel(delay=args.delay)
+    forest.llm_cache.limiter = LLMScheduler(concurrency=args.concurrency, queue_depth=args.queue_depth,
+                                            timeout=args.timeout)
+    client = forest.app.test_client()
+
+    def chat(i):
+        start = time.perf_counter()
+        response = client.get(f'/api/chat?message=question {i}')
+        return response.status_code, response.headers.get('Retry-After'), time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.requests) as pool:
+        results = list(pool.map(chat, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _, _ in results)
+    rejected = sorted(seconds for status, _, seconds in results if status == 503)
+    print(f"{args.requests} chats, {args.concurrency} slots, queue {args.queue_depth}: {dict(statuses)} "
+          f"in {elapsed:.2f}s, {forest.model.calls} upstream calls")
+    if rejected:
+        retry_after = sorted({value for status, value, _ in results if status == 503})
+        print(f"503s answered in {rejected[len(rejected) // 2] * 1000:.1f} ms (p50), Retry-After {retry_after}")
+
+
+if __name__ == '__main__':
+    main()
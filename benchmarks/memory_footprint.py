@@ -0,0 +1,75 @@
+# Per-sheet memory of the loaded workbook and its derived arrays, previous layout vs the compact one,
+# plus the result cube, map layers and chat facts a fully warmed worker holds:
+#   python benchmarks/memory_footprint.py [workbook]
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import pandas as pd  # noqa: E402
+
+import app as forest  # noqa: E402
+from dataset import NAME_COLUMNS, SHEETS, WORKBOOK_PATH, derived_arrays, load_workbook, memory_report  # noqa: E402
+from retrieval import DEFAULT_DENSITY  # noqa: E402
+
+
+def legacy_sheet(frame):
+    # Every column of the export, names as Python strings, numbers as parsed (int64/float64)
+    for column in frame.columns:
+        if column in NAME_COLUMNS:
+            frame[column] = frame[column].astype(object)
+        elif frame[column].dtype == object:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    return frame
+
+
+def kb(value):
+    return f'{value / 1024:,.1f}'
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else WORKBOOK_PATH
+    raw = pd.read_excel(path, sheet_name=list(SHEETS.values()))
+    dataset = load_workbook(path)
+    # What FOREST_MATERIALIZE=1 and the first map and chat requests build; the same in both layouts
+    with forest.app.app_context():
+        forest.get_result_cube(dataset, materialize=False).materialize()
+    for level in forest.MAP_LEVELS:
+        forest.get_map_layers(level, dataset)
+    forest.get_fact_index(dataset).facts(DEFAULT_DENSITY)
+    report = memory_report(dataset)
+
+    print(f"{'sheet':<20} {'columns':>9} {'before KB':>10} {'private':>9} {'after KB':>9} {'private':>9}")
+    totals = [0, 0, 0, 0]
+    for key, name in SHEETS.items():
+        frame = legacy_sheet(raw[name])
+        before = int(frame.memory_usage(index=False, deep=True).sum())
+        # Numbers were already mapped from the cache; the object name columns were private copies
+        before_private = sum(int(frame[column].memory_usage(index=False, deep=True))
+                             for column in frame.columns if frame[column].dtype == object)
+        after = report[key]
+        after_private = after['bytes'] - after['mapped_bytes']
+        for i, value in enumerate((before, before_private, after['bytes'], after_private)):
+            totals[i] += value
+        print(f"{key:<20} {len(frame.columns):>4} > {after['columns']:<2} {kb(before):>10} {kb(before_private):>9} "
+              f"{kb(after['bytes']):>9} {kb(after_private):>9}")
+    # Yearly matrices and trend tables are built in every worker; they used to be all float64
+    arrays = derived_arrays(dataset)
+    before = sum(value.size * 8 for value in arrays)
+    after = report['derived']['bytes']
+    for i, value in enumerate((before, before, after, after)):
+        totals[i] += value
+    print(f"{'derived':<20} {len(arrays):>9} {kb(before):>10} {kb(before):>9} {kb(after):>9} {kb(after):>9}")
+    print(f"{'total':<20} {'':>9} {kb(totals[0]):>10} {kb(totals[1]):>9} {kb(totals[2]):>9} {kb(totals[3]):>9}")
+    for key in ('result_cube', 'map_layers_state', 'map_layers_district', 'facts'):
+        size = report[key]['bytes']
+        for i in range(4):
+            totals[i] += size
+        print(f"{key:<20} {report[key]['entries']:>9} {kb(size):>10} {kb(size):>9} {kb(size):>9} {kb(size):>9}")
+    print(f"{'warmed total':<20} {'':>9} {kb(totals[0]):>10} {kb(totals[1]):>9} {kb(totals[2]):>9} {kb(totals[3]):>9}")
+
+
+if __name__ == '__main__':
+    main()
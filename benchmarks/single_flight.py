@@ -0,0 +1,96 @@
+# Concurrent identical analyses, plain and streamed, against the stub model: python benchmarks/single_flight.py
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+# No background rebuilds while measuring
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import app as forest  # noqa: E402
+import asgi  # noqa: E402
+from stubs import FakeModel  # noqa: E402
+
+
+def stream_status(body):
+    # Cache status from the done event of a Server-Sent Events body
+    for block in body.split('\n\n'):
+        if block.startswith('event: done'):
+            return json.loads(block.split('data: ', 1)[1])['cache']
+    return 'error'
+
+
+def burst_sync(path, concurrency, stream=False):
+    client = forest.app.test_client()
+
+    def one(_):
+        response = client.get(path, query_string={'stream': '1'} if stream else None)
+        return stream_status(response.get_data(as_text=True)) if stream else response.headers.get('X-LLM-Cache')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return Counter(pool.map(one, range(concurrency)))
+
+
+async def burst_async(path, concurrency, stream=False):
+    statuses = Counter()
+
+    async def one():
+        headers = {}
+        body = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                headers.update(message['headers'])
+            else:
+                body.append(message.get('body', b''))
+
+        await asgi.application({'type': 'http', 'path': path, 'method': 'GET',
+                                'query_string': b'stream=1' if stream else b'', 'headers': []}, receive, send)
+        if stream:
+            statuses[stream_status(b''.join(body).decode())] += 1
+        else:
+            statuses[headers.get(b'x-llm-cache', b'').decode()] += 1
+
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--delay', type=float, default=0.5)
+    args = parser.parse_args()
+
+    for stream in (False, True):
+        for name, burst in [('flask', lambda path: burst_sync(path, args.concurrency, stream)),
+                            ('asgi', lambda path: asyncio.run(burst_async(path, args.concurrency, stream)))]:
+            forest.model = FakeModel(delay=args.delay)
+            forest.llm_cache.clear()
+            start = time.perf_counter()
+            statuses = burst(f'/data/analyze/Kerala/{30 if name == "flask" else 50}')
+            elapsed = time.perf_counter() - start
+            print(f"{name}{' stream' if stream else ''}: {args.concurrency} identical requests, "
+                  f"{forest.model.calls} upstream call(s), {dict(statuses)} in {elapsed:.2f}s")
+
+    # Pre-generation: record demand, drop the cache, then warm the hottest pairs
+    forest.model = FakeModel(delay=0)
+    for location, density in [('kerala', 30.0)] * 3 + [('goa', 50.0)] * 2 + [('assam', 75.0)]:
+        forest.analysis_demand.record(forest.DEFAULT_ISO, location, density)
+    forest.llm_cache.clear()
+    forest.prewarmer.top_n = 2
+    warmed = forest.prewarmer.run_once()
+    status = forest.app.test_client().get('/data/analyze/Kerala/30').headers.get('X-LLM-Cache')
+    print(f"prewarm: generated {warmed} analyses, next Kerala request was a cache {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# The API with the stub Gemini model, for load tests:
+#   gunicorn --pythonpath .,benchmarks stub_app:app
+#   uvicorn --app-dir benchmarks stub_app:application
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+# No background rebuilds while measuring
+os.environ.setdefault('FOREST_JOBS', '0')
+
+import app as forest
+from stubs import FakeModel
+
+forest.model = FakeModel(delay=float(os.getenv('STUB_LLM_DELAY', 0.5)))
+# Every chat in a load test is distinct, but keep the cache out of the measurement anyway
+forest.llm_cache.max_entries = 0
+# Measure the serving model, not the LLM concurrency limiter
+forest.llm_cache.limiter = None
+
+app = forest.app
+
+from asgi import application  # noqa: E402
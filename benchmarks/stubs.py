@@ -0,0 +1,31 @@
+# Offline stand-ins for Gemini and Custom Search so benchmarks never touch the network
+import time
+
+from model_client import FakeModel, FakeResponse  # noqa: F401
+
+
+class FakeSearchResponse:
+    status_code = 200
+
+    def __init__(self, items):
+        self._items = items
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'items': self._items}
+
+
+class FakeSearchClient:
+    # Same get() signature as http_client.HTTPClient
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        query = (params or {}).get('q', '')
+        return FakeSearchResponse([{'title': f'News {i}', 'snippet': query, 'link': f'https://example.org/{i}'}
+                                   for i in range(5)])
@@ -0,0 +1,82 @@
+# Per-request CPU time of analyze_data's yearly extraction, per-year loop vs dense arrays.
+# Usage: python benchmarks/yearly_series.py
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FOREST_MATERIALIZE', '0')
+
+from app import analyze_data, format_value, yearly_entries, series_total
+from dataset import get_dataset, loss_column, emissions_column
+
+
+def loop_extraction(tree_row, carbon_row):
+    # The pre-vectorization loop, kept here only as the baseline
+    yearly_data = {'tree_loss': {}, 'emissions': {}}
+    total_loss = 0
+    total_emissions = 0
+    for year in range(2001, 2024):
+        # float() as the old float64 frame gave; float32 scalars format differently
+        loss_value = float(tree_row[loss_column(year)])
+        if not pd.isna(loss_value):
+            total_loss += float(loss_value)
+        yearly_data['tree_loss'][str(year)] = {
+            'value': float(loss_value) if not pd.isna(loss_value) else None,
+            'formatted': format_value(loss_value, 'hectares')
+        }
+        emissions_value = float(carbon_row[emissions_column(year)])
+        if not pd.isna(emissions_value):
+            total_emissions += float(emissions_value)
+        yearly_data['emissions'][str(year)] = {
+            'value': float(emissions_value) if not pd.isna(emissions_value) else None,
+            'formatted': format_value(emissions_value, 'Mg CO₂e')
+        }
+    return yearly_data, total_loss, total_emissions
+
+
+def vectorized_extraction(series, tree_offset, carbon_offset):
+    loss = series.tree_loss[tree_offset].astype(float)
+    emissions = series.emissions[carbon_offset].astype(float)
+    yearly_data = {
+        'tree_loss': yearly_entries(series.labels, loss, 'hectares'),
+        'emissions': yearly_entries(series.labels, emissions, 'Mg CO₂e')
+    }
+    return yearly_data, series_total(loss), series_total(emissions)
+
+
+def timed(label, func, calls):
+    start = time.perf_counter()
+    for args in calls:
+        func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / len(calls) * 1e6:10.1f} us/call  ({len(calls)} calls)")
+    return elapsed
+
+
+def main():
+    dataset = get_dataset()
+    carbon = dataset.carbon('district')
+    tree = dataset.tree('district')
+    series = dataset.series('district')
+
+    offsets = list(range(len(tree)))
+    loop_calls = [(tree.iloc[i], carbon.iloc[i]) for i in offsets]
+    vector_calls = [(series, i, i) for i in offsets]
+
+    for (a, b) in zip(loop_calls[:50], vector_calls[:50]):
+        assert loop_extraction(*a) == vectorized_extraction(*b)
+
+    loop = timed('per-year loop', loop_extraction, loop_calls)
+    vector = timed('dense arrays', vectorized_extraction, vector_calls)
+    print(f"speedup: {loop / vector:.1f}x")
+
+    index = dataset.index
+    requests = [(key, float(t)) for level in ('state', 'district')
+                for key in index.names(level) for t in index.get(level, key).thresholds]
+    timed('analyze_data (end to end)', analyze_data, requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = int(os.getenv('FOREST_COMPRESS_MIN_SIZE', 500))
+GZIP_LEVEL = int(os.getenv('FOREST_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('FOREST_BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/octet-stream', 'text/plain', 'text/html')
+
+
+def choose_encoding(accept_encodings):
+    # accept_encodings is request.accept_encodings; prefer brotli when both are accepted
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_body(data, encoding, min_size=MIN_SIZE):
+    # (body, Content-Encoding or None); small bodies are not worth compressing
+    if encoding is None or len(data) < min_size:
+        return data, None
+    return compress(data, encoding), encoding
+
+
+def compress_response(response, accept_encodings, min_size=MIN_SIZE):
+    # Bodies the view already compressed (precomputed ones) only get the headers
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' not in response.headers:
+        data, encoding = encode_body(response.get_data(), choose_encoding(accept_encodings), min_size)
+        if encoding is None:
+            return response
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+    # The bytes differ from the identity body, so the validator can only be weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,54 @@
+# Services shared by app.py and Backend/app.py: the model client, the LLM cache and the metrics
+import os
+import time
+
+from dotenv import load_dotenv
+from flask import Response, g, jsonify, request
+
+import metrics
+from llm_cache import cache_from_env
+from model_client import get_model
+
+load_dotenv()
+
+MODEL_NAME = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+model = get_model(MODEL_NAME)
+
+# Prompts are built from deterministic data, so identical ones reuse the stored answer
+llm_cache = cache_from_env()
+
+
+BUSY_TEXT = "The assistant is busy right now. Please try again shortly."
+
+
+def overloaded_payload(error):
+    return {"error": str(error), "retry_after": error.retry_after}
+
+
+def overloaded(error, text=False):
+    # 503 with Retry-After instead of holding the worker while the model is saturated
+    headers = {'Retry-After': str(error.retry_after)}
+    if text:
+        return BUSY_TEXT, 503, headers
+    return jsonify(overloaded_payload(error)), 503, headers
+
+
+def instrument(app):
+    # Request timing and the /metrics route, registered before the app's own hooks
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.request_duration.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -0,0 +1,435 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from metrics import span
+from trends import build_tables
+
+WORKBOOK_PATH = os.getenv('FOREST_WORKBOOK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'IND.xlsx'))
+CACHE_DIR = os.getenv('FOREST_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(WORKBOOK_PATH)), '.forest_cache'))
+
+# Other country exports live next to the default one as <ISO>.xlsx, e.g. BRA.xlsx
+DATA_DIR = os.getenv('FOREST_DATA_DIR', os.path.dirname(os.path.abspath(WORKBOOK_PATH)))
+DEFAULT_ISO = (os.getenv('FOREST_DEFAULT_ISO') or os.path.splitext(os.path.basename(WORKBOOK_PATH))[0]).upper()
+# How many workbooks may be resident at once, least recently used are dropped first
+MAX_DATASETS = int(os.getenv('FOREST_MAX_DATASETS', 4))
+ISO_WORKBOOK = re.compile(r'^([A-Za-z]{3})\.xlsx$')
+
+# Bump when the on-disk layout changes so old caches are ignored
+CACHE_FORMAT = 2
+
+# Sheets of the Global Forest Watch export that the API reads
+SHEETS = {
+    'country_carbon': 'Country carbon data',
+    'country_tree': 'Country tree cover loss',
+    'state_carbon': 'Subnational 1 carbon data',
+    'state_tree': 'Subnational 1 tree cover loss',
+    'district_carbon': 'Subnational 2 carbon data',
+    'district_tree': 'Subnational 2 tree cover loss'
+}
+
+NAME_COLUMNS = ['country', 'state', 'district']
+
+LOSS_COLUMN = re.compile(r'^tc_loss_ha_(\d{4})$')
+EMISSIONS_COLUMN = re.compile(r'^gfw_forest_carbon_gross_emissions_(\d{4})__Mg_CO2e$')
+
+THRESHOLD_COLUMNS = ('threshold', 'umd_tree_cover_density_2000__threshold')
+# The per-row figures analyze_data reads; rankings, map layers and chat facts use the same ones.
+# Every other column of the export is dropped at load
+VALUE_COLUMNS = {
+    'umd_tree_cover_extent_2000__ha',
+    'gfw_aboveground_carbon_stocks_2000__Mg_C',
+    'avg_gfw_aboveground_carbon_stocks_2000__Mg_C_ha-1',
+    'extent_2000_ha',
+    'extent_2010_ha',
+    'gain_2000-2020_ha'
+}
+
+
+def loss_column(year):
+    return f'tc_loss_ha_{year}'
+
+
+def emissions_column(year):
+    return f'gfw_forest_carbon_gross_emissions_{year}__Mg_CO2e'
+
+
+def _year_matrix(frame, columns):
+    # Dense (rows x years), float32 when every value round-trips; missing columns become all-NaN.
+    # Readers cast the rows they take to float64 before any arithmetic
+    matrix = np.full((len(frame), len(columns)), np.nan)
+    for i, column in enumerate(columns):
+        if column in frame.columns:
+            matrix[:, i] = frame[column].to_numpy(dtype=float)
+    return _narrow(matrix, np.float32)
+
+
+class YearlySeries:
+    def __init__(self, carbon, tree):
+        self.years = sorted(int(m.group(1)) for m in map(LOSS_COLUMN.match, tree.columns) if m)
+        self.labels = [str(year) for year in self.years]
+        self.tree_loss = _year_matrix(tree, [loss_column(year) for year in self.years])
+        self.emissions = _year_matrix(carbon, [emissions_column(year) for year in self.years])
+
+
+# Counts and sums of years since 2000 are small integers; sums of figures are float32 only when exact
+TABLE_DTYPES = {
+    'count': np.uint8,
+    'x_total': np.uint16,
+    'xx_total': np.uint16,
+    'total': np.float32,
+    'xy_total': np.float32,
+    'yoy': np.float32
+}
+
+
+def _compact_table(table):
+    # Readers cast what they take to float64, so storage is as narrow as round-trips exactly
+    for name, dtype in TABLE_DTYPES.items():
+        setattr(table, name, _narrow(getattr(table, name), dtype))
+    return table
+
+
+def _build_tables(series, base=None):
+    return {name: _compact_table(table) for name, table in build_tables(series, base).items()}
+
+
+class ForestDataset:
+    def __init__(self, path, sheets, mtime, version=None):
+        self.path = path
+        self.sheets = sheets
+        self.mtime = mtime
+        self.version = version
+        self._series = {}
+        self._trends = {}
+        # Structures built from this copy (result cube, map layers), dropped with it
+        self.derived = {}
+
+    @cached_property
+    def country_name(self):
+        names = self.carbon('country')['country'].to_numpy()
+        return str(names[0]) if len(names) else os.path.splitext(os.path.basename(self.path))[0]
+
+    def sheet(self, key):
+        return self.sheets[key]
+
+    def carbon(self, level):
+        return self.sheets[f'{level}_carbon']
+
+    def tree(self, level):
+        return self.sheets[f'{level}_tree']
+
+    def series(self, level):
+        series = self._series.get(level)
+        if series is None:
+            series = self._series.setdefault(level, YearlySeries(self.carbon(level), self.tree(level)))
+        return series
+
+    def trends(self, level):
+        tables = self._trends.get(level)
+        if tables is None:
+            tables = self._trends.setdefault(level, _build_tables(self.series(level)))
+        return tables
+
+    def build_trends(self, previous=None):
+        # Precomputed at load time; when a reload only appends years, just the new tail is computed
+        for level in NAME_COLUMNS:
+            base = previous._trends.get(level) if previous is not None else None
+            self._trends[level] = _build_tables(self.series(level), base)
+
+    @cached_property
+    def index(self):
+        from location_index import LocationIndex
+        return LocationIndex(self)
+
+
+def _keep_column(level, column):
+    if column in NAME_COLUMNS:
+        # A sheet's own level name, plus the state of each district
+        return column == level or column in NAME_COLUMNS[1:NAME_COLUMNS.index(level)]
+    return (column in THRESHOLD_COLUMNS or column in VALUE_COLUMNS
+            or bool(LOSS_COLUMN.match(column)) or bool(EMISSIONS_COLUMN.match(column)))
+
+
+def _narrow(values, dtype):
+    # values as dtype when that round-trips exactly, unchanged otherwise
+    narrow = values.astype(dtype)
+    with np.errstate(invalid='ignore'):
+        exact = np.array_equal(narrow.astype(values.dtype), values, equal_nan=values.dtype.kind == 'f')
+    return narrow if exact else values
+
+
+def _normalize_sheet(frame, level):
+    # Names become categoricals, thresholds int8 and figures float32 wherever that loses nothing
+    compact = {}
+    for column in frame.columns:
+        if not _keep_column(level, column):
+            continue
+        values = frame[column]
+        if column in NAME_COLUMNS:
+            compact[column] = pd.Categorical(values.astype(object))
+            continue
+        if values.dtype == object:
+            values = pd.to_numeric(values, errors='coerce')
+        values = values.to_numpy()
+        if column in THRESHOLD_COLUMNS:
+            compact[column] = _narrow(values, np.int8) if values.dtype.kind == 'i' else values
+        else:
+            compact[column] = _narrow(values, np.float32)
+    return pd.DataFrame(compact, copy=False)
+
+
+def parse_workbook(path=WORKBOOK_PATH):
+    # One openpyxl pass for every sheet instead of one per read_excel call
+    raw = pd.read_excel(path, sheet_name=list(SHEETS.values()))
+    return {key: _normalize_sheet(raw[name], key.split('_')[0]) for key, name in SHEETS.items()}
+
+
+def workbook_hash(path=WORKBOOK_PATH):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(version, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'{version}-v{CACHE_FORMAT}')
+
+
+def write_cache(sheets, version, cache_dir=CACHE_DIR):
+    target = cache_path(version, cache_dir)
+    if os.path.isdir(target):
+        return target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=cache_dir, prefix='.build-')
+    try:
+        manifest = {}
+        for key, frame in sheets.items():
+            os.makedirs(os.path.join(staging, key))
+            columns = []
+            for i, column in enumerate(frame.columns):
+                values = frame[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    # Codes plus a fixed-width unicode dictionary keep name columns pickle-free
+                    np.save(os.path.join(staging, key, f'{i}.categories.npy'),
+                            values.cat.categories.to_numpy().astype(str), allow_pickle=False)
+                    values = values.cat.codes
+                np.save(os.path.join(staging, key, f'{i}.npy'), values.to_numpy(), allow_pickle=False)
+                columns.append({'name': column, 'categorical': column in NAME_COLUMNS})
+            manifest[key] = columns
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another worker finished the same build first
+            if not os.path.isdir(target):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+
+def read_cache(version, cache_dir=CACHE_DIR):
+    target = cache_path(version, cache_dir)
+    with open(os.path.join(target, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    sheets = {}
+    for key in SHEETS:
+        data = {}
+        for i, column in enumerate(manifest[key]):
+            file = os.path.join(target, key, f'{i}.npy')
+            # Read-only mappings are shared through the page cache by every worker
+            values = np.load(file, mmap_mode='r', allow_pickle=False)
+            if column['categorical']:
+                categories = np.load(os.path.join(target, key, f'{i}.categories.npy'), allow_pickle=False)
+                values = pd.Categorical.from_codes(values, categories=categories.astype(object))
+            data[column['name']] = values
+        sheets[key] = pd.DataFrame(data, copy=False)
+    return sheets
+
+
+def load_workbook(path=WORKBOOK_PATH, cache_dir=CACHE_DIR):
+    mtime = os.stat(path).st_mtime_ns
+    version = workbook_hash(path)
+    try:
+        with span('dataset_cache_read'):
+            sheets = read_cache(version, cache_dir)
+    except (OSError, ValueError, KeyError):
+        # Cache missing or stale, fall back to Excel and rebuild it
+        with span('excel_parse'):
+            sheets = parse_workbook(path)
+        try:
+            write_cache(sheets, version, cache_dir)
+        except OSError as e:
+            print(f"Could not write dataset cache: {str(e)}")
+    return ForestDataset(path, sheets, mtime, version)
+
+
+def _mapped(values):
+    # True when the array is a view of a read-only mapping of the columnar cache
+    while isinstance(values, np.ndarray):
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+def sheet_memory(frame):
+    # (bytes, bytes mapped from the cache): mapped pages are shared by every worker, the rest is private
+    total = mapped = 0
+    for column in frame.columns:
+        values = frame[column]
+        total += int(values.memory_usage(index=False, deep=True))
+        array = values.array.codes if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+        if _mapped(array):
+            mapped += array.nbytes
+    return total, mapped
+
+
+def derived_arrays(dataset):
+    # The yearly matrices and trend tables of every level, each array once
+    arrays = {}
+    for level in NAME_COLUMNS:
+        series = dataset.series(level)
+        tables = dataset.trends(level)
+        for owner in [series] + list(tables.values()):
+            arrays.update((id(value), value) for value in vars(owner).values() if isinstance(value, np.ndarray))
+    return list(arrays.values())
+
+
+def memory_report(dataset):
+    # Footprint of every sheet plus the dense arrays derived from them, which are private to each worker
+    report = {}
+    for key, frame in dataset.sheets.items():
+        total, mapped = sheet_memory(frame)
+        report[key] = {'rows': len(frame), 'columns': len(frame.columns), 'bytes': total, 'mapped_bytes': mapped}
+    arrays = derived_arrays(dataset)
+    report['derived'] = {'arrays': len(arrays), 'bytes': sum(value.nbytes for value in arrays), 'mapped_bytes': 0}
+    # Result cube, map layers and fact index, once built; also private to each worker
+    for key, value in list(dataset.derived.items()):
+        name = '_'.join(key) if isinstance(key, tuple) else key
+        report[name] = {'entries': len(value), 'bytes': value.nbytes(), 'mapped_bytes': 0}
+    return report
+
+
+class UnknownCountryError(KeyError):
+    pass
+
+
+_datasets = OrderedDict()
+_lock = threading.Lock()
+
+# Cleared when a background job watches the workbooks, so requests never stat or reload them
+RELOAD_ON_REQUEST = True
+
+
+def get_dataset(path=WORKBOOK_PATH, reload=None):
+    current = _datasets.get(path)
+    reload = RELOAD_ON_REQUEST if reload is None else reload
+    mtime = None
+    if current is None or reload:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+    if current is not None and (not reload or mtime is None or current.mtime == mtime):
+        try:
+            _datasets.move_to_end(path)
+        except KeyError:
+            pass
+        return current
+
+    with _lock:
+        current = _datasets.get(path)
+        if current is not None and (mtime is None or current.mtime == mtime):
+            return current
+        try:
+            if current is not None and mtime is not None and workbook_hash(path) == current.version:
+                # Touched but not modified
+                current.mtime = mtime
+                return current
+            dataset = load_workbook(path)
+            dataset.build_trends(current)
+        except Exception as e:
+            # Keep serving the previous copy if the workbook is mid-write
+            if current is None:
+                raise
+            print(f"Error reloading workbook: {str(e)}")
+            current.mtime = mtime
+            return current
+        _datasets[path] = dataset
+        _datasets.move_to_end(path)
+        while len(_datasets) > MAX_DATASETS:
+            _datasets.popitem(last=False)
+        return dataset
+
+
+def reload_on_request(enabled):
+    global RELOAD_ON_REQUEST
+    RELOAD_ON_REQUEST = enabled
+
+
+def country_workbook(iso):
+    iso = iso.upper()
+    return WORKBOOK_PATH if iso == DEFAULT_ISO else os.path.join(DATA_DIR, f'{iso}.xlsx')
+
+
+def _data_dir_mtime():
+    try:
+        return os.stat(DATA_DIR).st_mtime_ns
+    except OSError:
+        return 0
+
+
+# (DATA_DIR mtime, codes) of the last listing
+_countries = (None, [DEFAULT_ISO])
+
+
+def available_countries(refresh=False):
+    # Listed once, then again on each dataset refresh; when reloading on request, whenever
+    # DATA_DIR changes, like the workbook stat that mode already does
+    global _countries
+    listed, codes = _countries
+    if refresh or listed is None or (RELOAD_ON_REQUEST and _data_dir_mtime() != listed):
+        listed = _data_dir_mtime()
+        codes = {DEFAULT_ISO}
+        try:
+            codes.update(match.group(1).upper() for match in map(ISO_WORKBOOK.match, os.listdir(DATA_DIR)) if match)
+        except OSError:
+            pass
+        codes = sorted(codes)
+        _countries = (listed, codes)
+    return codes
+
+
+def resident_paths():
+    return list(_datasets)
+
+
+def get_country(iso):
+    # Lazily loads (or reuses) the workbook for an ISO 3166 alpha-3 code
+    path = country_workbook(iso)
+    if path not in _datasets and not os.path.exists(path):
+        raise UnknownCountryError(iso.upper())
+    return get_dataset(path)
+
+
+if __name__ == '__main__':
+    # Build step: python dataset.py [workbook]
+    source = sys.argv[1] if len(sys.argv) > 1 else WORKBOOK_PATH
+    version = workbook_hash(source)
+    print(f"Building dataset cache for {source} ({version[:12]})")
+    print(write_cache(parse_workbook(source), version))
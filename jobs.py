@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from sqlite_db import connect
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JobQueue:
+    # Persistent job queue in SQLite, drained by a few worker threads. Shared jobs run once in
+    # whichever process claims them; local ones (owner = this pid) touch this process's memory.
+    # Nothing touches disk or starts a thread until the first call that needs it
+    def __init__(self, db_path, workers=2, poll=1.0, history=86400):
+        self.db_path = db_path
+        self.workers = workers
+        self.poll = poll
+        # Finished jobs older than this many seconds are pruned
+        self.history = history
+        self.pid = os.getpid()
+        self._handlers = {}
+        self._schedules = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        # pid of the process whose threads are running, threads do not survive fork
+        self._started = None
+        self._ready = False
+
+    def _create(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with connect(self.db_path) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs '
+                '(id INTEGER PRIMARY KEY, kind TEXT, args TEXT, owner INTEGER, worker INTEGER, status TEXT, '
+                'created REAL, started REAL, finished REAL, result TEXT, error TEXT)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_kind ON jobs (kind, finished)')
+        self._ready = True
+
+    def _connect(self):
+        if not self._ready:
+            self._create()
+        return connect(self.db_path)
+
+    def register(self, kind, handler, every=None, local=False):
+        # handler(*args) runs in a worker thread; `every` seconds schedules it with no args
+        self._handlers[kind] = handler
+        if every:
+            self._schedules[kind] = (every, local)
+
+    def enqueue(self, kind, *args, local=False):
+        # Returns the job id, or the id of the identical job already waiting
+        if kind not in self._handlers:
+            raise KeyError(f"Unknown job kind {kind}")
+        payload = json.dumps(args)
+        owner = self.pid if local else None
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT id FROM jobs WHERE kind = ? AND args = ? AND owner IS ? AND status = ?',
+                             (kind, payload, owner, QUEUED)).fetchone()
+            if row is not None:
+                return row[0]
+            job_id = db.execute('INSERT INTO jobs (kind, args, owner, status, created) VALUES (?, ?, ?, ?, ?)',
+                                (kind, payload, owner, QUEUED, time.time())).lastrowid
+        self._wake.set()
+        return job_id
+
+    def _claim(self):
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                'SELECT id, kind, args FROM jobs WHERE status = ? AND (owner IS NULL OR owner = ?) '
+                'AND kind IN (%s) ORDER BY id LIMIT 1' % ','.join('?' * len(self._handlers)),
+                (QUEUED, self.pid, *self._handlers)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET status = ?, worker = ?, started = ? WHERE id = ?',
+                       (RUNNING, self.pid, time.time(), row[0]))
+        return row
+
+    def run_next(self):
+        job = self._claim()
+        if job is None:
+            return False
+        job_id, kind, args = job
+        started = time.perf_counter()
+        status, result, error = DONE, None, None
+        try:
+            result = self._handlers[kind](*json.loads(args))
+        except Exception as e:
+            status, error = FAILED, str(e)
+            print(f"Job {kind} failed: {str(e)}")
+        metrics.job_duration.observe(time.perf_counter() - started, kind, status)
+        try:
+            with self._connect() as db:
+                db.execute('UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?',
+                           (status, time.time(), json.dumps(result, default=str), error, job_id))
+                db.execute('DELETE FROM jobs WHERE finished < ?', (time.time() - self.history,))
+        except sqlite3.Error as e:
+            print(f"Job queue write error: {str(e)}")
+        return True
+
+    def _due(self, db, kind, every, local):
+        owner = self.pid if local else None
+        pending = db.execute(
+            'SELECT COUNT(*) FROM jobs WHERE kind = ? AND owner IS ? AND (status IN (?, ?) OR created > ?)',
+            (kind, owner, QUEUED, RUNNING, time.time() - every)
+        ).fetchone()[0]
+        return pending == 0
+
+    def schedule_due(self):
+        # Enqueue every scheduled kind whose last run started more than `every` seconds ago
+        enqueued = 0
+        for kind, (every, local) in self._schedules.items():
+            with self._connect() as db:
+                due = self._due(db, kind, every, local)
+            if due:
+                self.enqueue(kind, local=local)
+                enqueued += 1
+        return enqueued
+
+    def recover(self):
+        # Jobs left running by a process that died are marked failed so their kind is scheduled again
+        with self._connect() as db:
+            rows = db.execute('SELECT id, worker FROM jobs WHERE status = ?', (RUNNING,)).fetchall()
+            dead = [job_id for job_id, worker in rows if worker != self.pid and not _alive(worker)]
+            db.executemany('UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?',
+                           [(FAILED, time.time(), 'worker exited', job_id) for job_id in dead])
+            # Local jobs of dead processes can never be claimed
+            owners = db.execute('SELECT DISTINCT owner FROM jobs WHERE status = ? AND owner IS NOT NULL', (QUEUED,)).fetchall()
+            db.executemany('DELETE FROM jobs WHERE status = ? AND owner = ?',
+                           [(QUEUED, owner) for owner, in owners if owner != self.pid and not _alive(owner)])
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                ran = self.run_next()
+            except sqlite3.Error as e:
+                print(f"Job queue read error: {str(e)}")
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+
+    def _schedule(self):
+        while not self._stop.is_set():
+            try:
+                self.schedule_due()
+            except sqlite3.Error as e:
+                print(f"Job scheduler error: {str(e)}")
+            self._stop.wait(self.poll)
+
+    def start(self):
+        if self._started != os.getpid():
+            # A forked worker inherits the parent's thread list but none of its threads,
+            # so it starts its own and gets its own local jobs
+            self.pid = os.getpid()
+            self._threads = []
+            self._stop = threading.Event()
+            self._wake = threading.Event()
+            self._started = self.pid
+            self.recover()
+            self._threads.append(threading.Thread(target=self._schedule, name='jobs-scheduler', daemon=True))
+            for i in range(self.workers):
+                self._threads.append(threading.Thread(target=self._work, name=f'jobs-worker-{i}', daemon=True))
+            for thread in self._threads:
+                thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self, recent=20):
+        with self._connect() as db:
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            kinds = {}
+            for kind, runs, failures, mean, longest, last in db.execute(
+                    'SELECT kind, COUNT(*), SUM(status = ?), AVG(finished - started), MAX(finished - started), '
+                    'MAX(finished) FROM jobs WHERE finished IS NOT NULL GROUP BY kind', (FAILED,)):
+                kinds[kind] = {'runs': runs, 'failures': failures, 'mean_seconds': mean,
+                               'max_seconds': longest, 'last_finished': last}
+            jobs = db.execute(
+                'SELECT id, kind, args, status, created, started, finished, error FROM jobs ORDER BY id DESC LIMIT ?',
+                (recent,)
+            ).fetchall()
+        for kind, (every, local) in self._schedules.items():
+            kinds.setdefault(kind, {'runs': 0})
+            kinds[kind].update({'every_seconds': every, 'local': local})
+        return {
+            'running': self._started == os.getpid() and not self._stop.is_set(),
+            'workers': self.workers,
+            'counts': {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+            'kinds': kinds,
+            'recent': [{
+                'id': job_id,
+                'kind': kind,
+                'args': json.loads(args),
+                'status': status,
+                'created': created,
+                'duration_seconds': finished - started if finished and started else None,
+                'error': error
+            } for job_id, kind, args, status, created, started, finished, error in jobs]
+        }
@@ -0,0 +1,49 @@
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Same contract as Flask's provider (sorted keys, compact outside debug), encoded by orjson.
+    # NumPy scalars and arrays serialize natively; NaN becomes null instead of invalid JSON.
+    option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+              | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        # orjson output is always compact, so a separators request needs no fallback
+        kwargs.pop('separators', None)
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            # Keep the indented output Flask gives in debug mode
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+PROVIDERS = {
+    'default': DefaultJSONProvider,
+    'orjson': OrjsonProvider
+}
+
+
+def provider_from_env():
+    # FOREST_JSON_PROVIDER=default|orjson, orjson when it is installed
+    name = os.getenv('FOREST_JSON_PROVIDER') or ('orjson' if orjson else 'default')
+    if name == 'orjson' and orjson is None:
+        print("orjson is not installed, using the default JSON provider")
+        name = 'default'
+    return PROVIDERS[name]
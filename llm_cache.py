@@ -0,0 +1,425 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+import metrics
+from metrics import span
+from llm_limiter import OverloadedError, scheduler_from_env
+from sqlite_db import connect
+
+HIT = 'hit'
+MISS = 'miss'
+STALE = 'stale'
+# Served from another request's in-flight upstream call
+COALESCED = 'coalesced'
+# What followers of a stream get when its leader's client disconnects before the answer completes
+ABANDONED = "The identical request this one was following closed its stream"
+
+
+def normalize_prompt(prompt):
+    # Indentation and line breaks in the f-string templates don't change the answer
+    return ' '.join(prompt.split())
+
+
+def prompt_key(model_name, prompt):
+    return hashlib.sha256(f'{model_name}\0{normalize_prompt(prompt)}'.encode()).hexdigest()
+
+
+class _Flight:
+    # One upstream call that concurrent identical prompts wait on
+    def __init__(self, done):
+        self.done = done
+        self.text = None
+        self.error = None
+
+
+class _StreamFlight:
+    # One upstream stream whose chunks concurrent identical prompts replay as they arrive
+    def __init__(self):
+        self.chunks = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self._changed = threading.Condition()
+
+    def start(self):
+        with self._changed:
+            self.started = True
+            self._changed.notify_all()
+
+    def append(self, text):
+        with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+
+    def land(self, error):
+        with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    def wait(self, ready):
+        with self._changed:
+            self._changed.wait_for(ready)
+
+    def since(self, sent):
+        # Chunks after the first `sent`, blocking until there are some or the stream has ended
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.chunks) > sent or self.done)
+            return self.chunks[sent:], self.done
+
+
+class _AsyncStreamFlight(_StreamFlight):
+    # Event loop only, so no lock: waiters wake on an event that is replaced after every change
+    def __init__(self):
+        super().__init__()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def start(self):
+        self.started = True
+        self._notify()
+
+    def append(self, text):
+        self.chunks.append(text)
+        self._notify()
+
+    def land(self, error):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    async def wait(self, ready):
+        while not ready():
+            await self._changed.wait()
+
+    async def since(self, sent):
+        await self.wait(lambda: len(self.chunks) > sent or self.done)
+        return self.chunks[sent:], self.done
+
+
+class LLMCache:
+    def __init__(self, max_entries=256, ttl=86400, stale_ttl=None, db_path=None, limiter=None):
+        self.max_entries = max_entries
+        # Optional LLMScheduler that upstream calls (never cache hits) queue on
+        self.limiter = limiter
+        # Entries older than ttl are refreshed, and served as stale only if the refresh fails
+        self.ttl = ttl
+        self.stale_ttl = ttl if stale_ttl is None else stale_ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        self._stream_flights = {}
+        self._async_stream_flights = {}
+        if db_path:
+            with self._connect() as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS llm_cache '
+                    '(key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL)'
+                )
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def _remember(self, key, text, created):
+        with self._lock:
+            self._entries[key] = (text, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.db_path:
+            try:
+                with self._connect() as db:
+                    row = db.execute('SELECT response, created FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"LLM cache read error: {str(e)}")
+                row = None
+            if row is not None:
+                entry = row
+                self._remember(key, *row)
+
+        text, status = None, MISS
+        if entry is not None:
+            age = now - entry[1]
+            if age <= self.ttl:
+                text, status = entry[0], HIT
+            elif age <= self.ttl + self.stale_ttl:
+                text, status = entry[0], STALE
+        metrics.cache_requests.inc('llm', status)
+        return text, status
+
+    def set(self, key, text, model_name=None):
+        created = time.time()
+        self._remember(key, text, created)
+        if self.db_path:
+            try:
+                with self._connect() as db:
+                    db.execute(
+                        'INSERT OR REPLACE INTO llm_cache (key, model, response, created) VALUES (?, ?, ?, ?)',
+                        (key, model_name, text, created)
+                    )
+                    db.execute('DELETE FROM llm_cache WHERE created < ?', (created - self.ttl - self.stale_ttl,))
+            except sqlite3.Error as e:
+                print(f"LLM cache write error: {str(e)}")
+
+    def _slot(self, priority):
+        return self.limiter.slot(priority) if self.limiter else nullcontext()
+
+    def _aslot(self, priority):
+        return self.limiter.aslot(priority) if self.limiter else nullcontext()
+
+    def _failed(self, error):
+        if isinstance(error, OverloadedError):
+            metrics.llm_rejections.inc()
+        else:
+            metrics.upstream_errors.inc('gemini')
+
+    def _follow(self, flight, cached, status):
+        if flight.error is not None:
+            if status == STALE:
+                return cached, STALE
+            raise flight.error
+        return flight.text, COALESCED
+
+    def generate(self, model, model_name, prompt, priority='chat'):
+        # Returns (text, status) where status is hit, miss, stale or coalesced
+        key = prompt_key(model_name, prompt)
+        cached, status = self.get(key)
+        if status == HIT:
+            return cached, HIT
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(threading.Event())
+        if not leader:
+            flight.done.wait()
+            return self._follow(flight, cached, status)
+        try:
+            with self._slot(priority), span('llm'):
+                text = model.generate_content(prompt).text
+        except Exception as e:
+            self._failed(e)
+            flight.error = e
+            if status == STALE:
+                return cached, STALE
+            raise
+        else:
+            self.set(key, text, model_name)
+            flight.text = text
+            return text, MISS
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stream(self, model, model_name, prompt, priority='chat'):
+        # Iterator of (chunk, status); the cache lookup and the model slot happen before it is returned,
+        # so an overloaded caller gets OverloadedError here rather than mid-response
+        chunks = self._stream(model, model_name, prompt, priority)
+        next(chunks)
+        return chunks
+
+    def _stream(self, model, model_name, prompt, priority):
+        # Pauses once, before the first chunk, with the slot already held. Identical concurrent
+        # prompts follow the first one's upstream stream instead of opening their own
+        key = prompt_key(model_name, prompt)
+        cached, status = self.get(key)
+        if status == HIT:
+            yield
+            yield cached, HIT
+            return
+        with self._lock:
+            flight = self._stream_flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._stream_flights[key] = _StreamFlight()
+        if not leader:
+            # Waits for the leader's slot, so a leader turned away turns its followers away too
+            flight.wait(lambda: flight.started or flight.done)
+            if not flight.started and status != STALE:
+                raise flight.error
+            yield
+            yield from self._replay(flight, cached, status)
+            return
+
+        error = None
+        try:
+            with self._slot(priority), span('llm'):
+                flight.start()
+                yield
+                for chunk in model.generate_content(prompt, stream=True):
+                    text = chunk.text
+                    flight.append(text)
+                    yield text, MISS
+            self.set(key, ''.join(flight.chunks), model_name)
+        except Exception as e:
+            self._failed(e)
+            error = e
+        except GeneratorExit:
+            error = ConnectionAbortedError(ABANDONED)
+            raise
+        finally:
+            with self._lock:
+                self._stream_flights.pop(key, None)
+            flight.land(error)
+        if error is not None:
+            if status == STALE and not flight.chunks:
+                if not flight.started:
+                    yield
+                yield cached, STALE
+                return
+            raise error
+
+    def _replay(self, flight, cached, status):
+        # The leader's chunks so far, then each one as it arrives
+        sent = 0
+        while True:
+            chunks, done = flight.since(sent)
+            for text in chunks:
+                yield text, COALESCED
+            sent += len(chunks)
+            if done and not chunks:
+                break
+        if flight.error is not None:
+            if status == STALE and not sent:
+                yield cached, STALE
+                return
+            raise flight.error
+
+    async def _blocking(self, run, func, *args):
+        # SQLite reads and writes block, so the async paths hand them to run (asgi.run_cpu) when there is a db
+        if self.db_path and run is not None:
+            return await run(func, *args)
+        return func(*args)
+
+    async def agenerate(self, model, model_name, prompt, priority='chat', run=None):
+        # Awaitable generate() for the ASGI entry point
+        key = prompt_key(model_name, prompt)
+        cached, status = await self._blocking(run, self.get, key)
+        if status == HIT:
+            return cached, HIT
+        # Only the event loop touches these, so no lock is needed
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            await flight.done.wait()
+            return self._follow(flight, cached, status)
+        flight = self._async_flights[key] = _Flight(asyncio.Event())
+        try:
+            async with self._aslot(priority):
+                with span('llm'):
+                    response = await model.generate_content_async(prompt)
+                    text = response.text
+        except Exception as e:
+            self._failed(e)
+            flight.error = e
+            if status == STALE:
+                return cached, STALE
+            raise
+        else:
+            await self._blocking(run, self.set, key, text, model_name)
+            flight.text = text
+            return text, MISS
+        finally:
+            self._async_flights.pop(key, None)
+            flight.done.set()
+
+    async def astream(self, model, model_name, prompt, priority='chat', run=None):
+        # Awaitable stream(): the slot is held by the time the iterator is returned
+        chunks = self._astream(model, model_name, prompt, priority, run)
+        await chunks.__anext__()
+        return chunks
+
+    async def _astream(self, model, model_name, prompt, priority, run):
+        key = prompt_key(model_name, prompt)
+        cached, status = await self._blocking(run, self.get, key)
+        if status == HIT:
+            yield
+            yield cached, HIT
+            return
+        # Only the event loop touches these, so no lock is needed
+        flight = self._async_stream_flights.get(key)
+        if flight is not None:
+            await flight.wait(lambda: flight.started or flight.done)
+            if not flight.started and status != STALE:
+                raise flight.error
+            yield
+            async for item in self._areplay(flight, cached, status):
+                yield item
+            return
+
+        flight = self._async_stream_flights[key] = _AsyncStreamFlight()
+        error = None
+        try:
+            async with self._aslot(priority):
+                flight.start()
+                yield
+                with span('llm'):
+                    async for chunk in await model.generate_content_async(prompt, stream=True):
+                        text = chunk.text
+                        flight.append(text)
+                        yield text, MISS
+            await self._blocking(run, self.set, key, ''.join(flight.chunks), model_name)
+        except Exception as e:
+            self._failed(e)
+            error = e
+        except (GeneratorExit, asyncio.CancelledError):
+            error = ConnectionAbortedError(ABANDONED)
+            raise
+        finally:
+            self._async_stream_flights.pop(key, None)
+            flight.land(error)
+        if error is not None:
+            if status == STALE and not flight.chunks:
+                if not flight.started:
+                    yield
+                yield cached, STALE
+                return
+            raise error
+
+    async def _areplay(self, flight, cached, status):
+        sent = 0
+        while True:
+            chunks, done = await flight.since(sent)
+            for text in chunks:
+                yield text, COALESCED
+            sent += len(chunks)
+            if done and not chunks:
+                break
+        if flight.error is not None:
+            if status == STALE and not sent:
+                yield cached, STALE
+                return
+            raise flight.error
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def cache_from_env():
+    return LLMCache(
+        max_entries=int(os.getenv('LLM_CACHE_SIZE', 256)),
+        ttl=float(os.getenv('LLM_CACHE_TTL', 86400)),
+        stale_ttl=float(os.getenv('LLM_CACHE_STALE_TTL')) if os.getenv('LLM_CACHE_STALE_TTL') else None,
+        db_path=os.getenv('LLM_CACHE_DB') or None,
+        limiter=scheduler_from_env()
+    )
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Lower runs first: location analyses ahead of free-form chat, pre-generation last
+PRIORITIES = {
+    'analysis': 0,
+    'report': 1,
+    'chat': 2,
+    'background': 3
+}
+
+# How often cross-worker slots are polled while waiting
+POLL_INTERVAL = 0.05
+
+
+class OverloadedError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token and returns how long to wait before it may be spent
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class FileSlots:
+    # Cross-worker slots: one lock file per slot, held with flock for the length of a call
+    def __init__(self, directory, count):
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f'llm-slot-{i}.lock') for i in range(count)]
+
+    def try_acquire(self):
+        for path in self.paths:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class _Waiter:
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+class LLMScheduler:
+    def __init__(self, concurrency=4, queue_depth=32, timeout=10.0, rate=None, burst=None,
+                 lock_dir=None, global_concurrency=None):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        # Longest a request waits for a slot before it is turned away
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.slots = None
+        if lock_dir:
+            if fcntl is None:
+                print("Cross-worker LLM slots need fcntl, limiting per process only")
+            else:
+                self.slots = FileSlots(lock_dir, global_concurrency or concurrency)
+        self.active = 0
+        self.waiting = 0
+        self._queue = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        # Moving average of call duration, used for Retry-After
+        self.service_time = 2.0
+
+    def retry_after(self):
+        return max(1, math.ceil(self.service_time * (self.waiting + 1) / self.concurrency))
+
+    def _overloaded(self, message):
+        return OverloadedError(message, self.retry_after())
+
+    def _enqueue(self, priority, notify):
+        # None when a slot was free, otherwise a waiter to be notified on grant
+        with self._lock:
+            if self.active < self.concurrency and not self.waiting:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue_depth:
+                raise self._overloaded("Too many requests are waiting for the model")
+            waiter = _Waiter(notify)
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._order), waiter))
+            self.waiting += 1
+            return waiter
+
+    def _cancel(self, waiter):
+        # False when the slot was granted meanwhile, so the caller owns it after all
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            self.waiting -= 1
+            return True
+
+    def _release(self, elapsed=None):
+        with self._lock:
+            if elapsed is not None:
+                self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # Hand the slot straight to the next waiter
+                waiter.granted = True
+                self.waiting -= 1
+                waiter.notify()
+                return
+            self.active -= 1
+
+    def _token_wait(self, deadline):
+        if self.bucket is None:
+            return 0.0
+        wait = self.bucket.reserve()
+        if time.monotonic() + wait > deadline:
+            self.bucket.refund()
+            raise self._overloaded("Model rate limit reached")
+        return wait
+
+    def _overdue(self, deadline):
+        if time.monotonic() >= deadline:
+            raise self._overloaded("Timed out waiting for a model slot")
+
+    @contextmanager
+    def slot(self, priority='chat', timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        granted = threading.Event()
+        waiter = self._enqueue(priority, granted.set)
+        if waiter is not None and not granted.wait(max(0.0, deadline - time.monotonic())):
+            if self._cancel(waiter):
+                raise self._overloaded("Timed out waiting for a model slot")
+        started = None
+        fd = None
+        try:
+            time.sleep(self._token_wait(deadline))
+            if self.slots is not None:
+                while (fd := self.slots.try_acquire()) is None:
+                    self._overdue(deadline)
+                    time.sleep(POLL_INTERVAL)
+            started = time.monotonic()
+            yield
+        finally:
+            if fd is not None:
+                self.slots.release(fd)
+            self._release(None if started is None else time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, priority='chat', timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(priority, notify)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                if self._cancel(waiter):
+                    raise self._overloaded("Timed out waiting for a model slot")
+            except asyncio.CancelledError:
+                if not self._cancel(waiter):
+                    self._release()
+                raise
+        started = None
+        fd = None
+        try:
+            await asyncio.sleep(self._token_wait(deadline))
+            if self.slots is not None:
+                while (fd := self.slots.try_acquire()) is None:
+                    self._overdue(deadline)
+                    await asyncio.sleep(POLL_INTERVAL)
+            started = time.monotonic()
+            yield
+        finally:
+            if fd is not None:
+                self.slots.release(fd)
+            self._release(None if started is None else time.monotonic() - started)
+
+
+def scheduler_from_env():
+    rate = os.getenv('LLM_RATE')
+    burst = os.getenv('LLM_BURST')
+    global_concurrency = os.getenv('LLM_GLOBAL_CONCURRENCY')
+    return LLMScheduler(
+        concurrency=int(os.getenv('LLM_CONCURRENCY', 4)),
+        queue_depth=int(os.getenv('LLM_QUEUE_DEPTH', 32)),
+        timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 10)),
+        rate=float(rate) if rate else None,
+        burst=float(burst) if burst else None,
+        lock_dir=os.getenv('LLM_LOCK_DIR') or None,
+        global_concurrency=int(global_concurrency) if global_concurrency else None
+    )
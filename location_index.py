@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+THRESHOLD_COLUMNS = {
+    'carbon': 'umd_tree_cover_density_2000__threshold',
+    'tree': 'threshold'
+}
+
+# States win over districts of the same name, as in analyze_data
+LEVELS = ['state', 'district']
+
+NGRAM = 3
+
+
+def normalize(name):
+    return str(name).lower()
+
+
+def ngrams(text, n=NGRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _first_rows(rows, thresholds):
+    # Walk backwards so the first row in sheet order wins for each threshold
+    return {t: r for t, r in zip(thresholds[::-1].tolist(), rows[::-1].tolist())}
+
+
+class LocationEntry:
+    def __init__(self, key, name, level, carbon_rows, tree_rows, carbon_thresholds, tree_thresholds, state=None):
+        self.key = key
+        self.name = name
+        self.level = level
+        # Set for the exact per-state district entries
+        self.state = state
+        # Row offsets into the level's carbon and tree sheets
+        self.carbon_rows = carbon_rows
+        self.tree_rows = tree_rows
+        self.thresholds = list(np.unique(carbon_thresholds))
+        self._carbon_first = _first_rows(carbon_rows, carbon_thresholds)
+        self._tree_first = _first_rows(tree_rows, tree_thresholds)
+
+    def carbon_row(self, threshold):
+        return self._carbon_first.get(threshold)
+
+    def tree_row(self, threshold):
+        return self._tree_first.get(threshold)
+
+    def rows(self, threshold):
+        return self.carbon_row(threshold), self.tree_row(threshold)
+
+
+class LocationIndex:
+    def __init__(self, dataset):
+        self._entries = {level: {} for level in LEVELS}
+        self._ngrams = {}
+        self._districts = self._state_districts(dataset)
+
+        # Level membership comes from the district sheet, like the old list scan
+        district_carbon = dataset.carbon('district')
+        names = {
+            'state': district_carbon['state'].dropna(),
+            'district': district_carbon['district'].dropna()
+        }
+
+        for level in LEVELS:
+            carbon = dataset.carbon(level)
+            tree = dataset.tree(level)
+            carbon_names = np.array([normalize(x) for x in carbon[level]], dtype=object)
+            tree_names = np.array([normalize(x) for x in tree[level]], dtype=object)
+            carbon_thresholds = carbon[THRESHOLD_COLUMNS['carbon']].to_numpy()
+            tree_thresholds = tree[THRESHOLD_COLUMNS['tree']].to_numpy()
+            sheet_names = set(carbon_names) | set(tree_names)
+
+            canonical = {}
+            for name in names[level]:
+                canonical.setdefault(normalize(name), str(name))
+
+            for key, name in canonical.items():
+                # Rows of every name containing this one, matching the old substring filter
+                matches = [other for other in sheet_names if key in other]
+                carbon_rows = np.flatnonzero(np.isin(carbon_names, matches))
+                tree_rows = np.flatnonzero(np.isin(tree_names, matches))
+                entry = LocationEntry(key, name, level, carbon_rows, tree_rows,
+                                      carbon_thresholds[carbon_rows], tree_thresholds[tree_rows])
+                self._entries[level][key] = entry
+
+                for gram in ngrams(key):
+                    self._ngrams.setdefault(gram, set()).add((level, key))
+
+    @staticmethod
+    def _state_districts(dataset):
+        # Entries keyed by the exact (state, district) pair of each row. Names repeat across
+        # states (Bilaspur) and contain one another (Una in Junagadh), so names alone are ambiguous
+        sheets = {}
+        for sheet, frame in (('carbon', dataset.carbon('district')), ('tree', dataset.tree('district'))):
+            rows = {}
+            for row, pair in enumerate(zip(frame['state'], frame['district'])):
+                rows.setdefault((normalize(pair[0]), normalize(pair[1])), []).append(row)
+            thresholds = frame[THRESHOLD_COLUMNS[sheet]].to_numpy()
+            sheets[sheet] = rows, thresholds
+
+        carbon_rows, carbon_thresholds = sheets['carbon']
+        tree_rows, tree_thresholds = sheets['tree']
+        districts = {}
+        frame = dataset.carbon('district')
+        for state, district in zip(frame['state'], frame['district']):
+            if pd.isna(state) or pd.isna(district):
+                continue
+            pair = (normalize(state), normalize(district))
+            entries = districts.setdefault(pair[0], {})
+            if pair[1] not in entries:
+                carbon = np.array(carbon_rows[pair], dtype=np.intp)
+                tree = np.array(tree_rows.get(pair, []), dtype=np.intp)
+                entries[pair[1]] = LocationEntry(pair[1], str(district), 'district', carbon, tree,
+                                                 carbon_thresholds[carbon], tree_thresholds[tree], state=str(state))
+        return {state: list(entries.values()) for state, entries in districts.items()}
+
+    def resolve(self, location):
+        key = normalize(location)
+        for level in LEVELS:
+            entry = self._entries[level].get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def get(self, level, location):
+        return self._entries[level].get(normalize(location))
+
+    def districts_of(self, state):
+        # Exact district entries of a state in sheet order, None for an unknown state
+        return self._districts.get(normalize(state))
+
+    def names(self, level):
+        return sorted(self._entries[level])
+
+    def search(self, query, level=None, limit=None):
+        # Fuzzy mode: case-insensitive substring match narrowed by the n-gram postings
+        needle = normalize(query)
+        levels = [level] if level else LEVELS
+        if len(needle) < NGRAM:
+            candidates = {(lvl, key) for lvl in levels for key in self._entries[lvl]}
+        else:
+            postings = [self._ngrams.get(gram, set()) for gram in ngrams(needle)]
+            candidates = set.intersection(*sorted(postings, key=len))
+
+        results = [
+            self._entries[lvl][key]
+            for lvl, key in sorted(candidates, key=lambda c: (LEVELS.index(c[0]), c[1]))
+            if lvl in levels and needle in key
+        ]
+        return results[:limit] if limit else results
@@ -0,0 +1,104 @@
+import numpy as np
+
+# metric -> (unit, per-year)
+METRICS = {
+    'loss': ('hectares', True),
+    'cumulative_loss': ('hectares', True),
+    'emissions': ('Mg CO₂e', True),
+    'extent_2000': ('hectares', False),
+    'gain': ('hectares', False),
+    'carbon_stocks': ('Mg C', False),
+    'carbon_density': ('Mg C/ha', False)
+}
+STATIC_COLUMNS = {
+    'extent_2000': ('tree', 'extent_2000_ha'),
+    'gain': ('tree', 'gain_2000-2020_ha'),
+    'carbon_stocks': ('carbon', 'gfw_aboveground_carbon_stocks_2000__Mg_C'),
+    'carbon_density': ('carbon', 'avg_gfw_aboveground_carbon_stocks_2000__Mg_C_ha-1')
+}
+THRESHOLD_COLUMNS = {
+    'carbon': 'umd_tree_cover_density_2000__threshold',
+    'tree': 'threshold'
+}
+LEVELS = ('state', 'district')
+
+
+class MapLayers:
+    # Every region's value of a metric as one array per (metric, year, threshold),
+    # in a fixed region order so a choropleth needs a single request
+    def __init__(self, dataset, level):
+        if level not in LEVELS:
+            raise ValueError("Invalid location level")
+        self.dataset = dataset
+        self.level = level
+        self.years = list(dataset.series(level).years)
+        name_columns = ['state', 'district'] if level == 'district' else ['state']
+
+        tree = dataset.tree(level)
+        keys = list(zip(*(tree[column].to_numpy() for column in name_columns)))
+        self.regions = list(dict.fromkeys(keys))
+        position = {key: i for i, key in enumerate(self.regions)}
+        self.thresholds = sorted(float(t) for t in tree['threshold'].unique())
+
+        # Region slot of every sheet row
+        self._slots = {}
+        for sheet_name in ('carbon', 'tree'):
+            frame = dataset.carbon(level) if sheet_name == 'carbon' else dataset.tree(level)
+            rows = zip(*(frame[column].to_numpy() for column in name_columns))
+            self._slots[sheet_name] = np.array([position.get(key, -1) for key in rows])
+
+        self._layers = {}
+        for metric in METRICS:
+            for threshold in self.thresholds:
+                self._build(metric, threshold)
+
+    def _scatter(self, sheet_name, threshold, matrix):
+        # Sheet rows at this threshold -> (regions x columns), NaN where a region has no row
+        frame = self.dataset.carbon(self.level) if sheet_name == 'carbon' else self.dataset.tree(self.level)
+        rows = np.flatnonzero(frame[THRESHOLD_COLUMNS[sheet_name]].to_numpy() == threshold)
+        slots = self._slots[sheet_name][rows]
+        grid = np.full((len(self.regions), matrix.shape[1]), np.nan)
+        keep = slots >= 0
+        # Reversed so the first row wins for duplicated names, matching the location index
+        grid[slots[keep][::-1]] = matrix[rows[keep][::-1]]
+        return grid
+
+    def _build(self, metric, threshold):
+        if metric in STATIC_COLUMNS:
+            sheet_name, column = STATIC_COLUMNS[metric]
+            frame = self.dataset.carbon(self.level) if sheet_name == 'carbon' else self.dataset.tree(self.level)
+            grid = self._scatter(sheet_name, threshold, frame[column].to_numpy(dtype=float)[:, None])
+            self._layers[(metric, None, threshold)] = np.ascontiguousarray(grid[:, 0])
+            return
+        if metric == 'emissions':
+            grid = self._scatter('carbon', threshold, self.dataset.series(self.level).emissions)
+        elif metric == 'loss':
+            grid = self._scatter('tree', threshold, self.dataset.series(self.level).tree_loss)
+        else:
+            table = self.dataset.trends(self.level)['tree_loss']
+            grid = self._scatter('tree', threshold, np.where(table.count > 0, table.total, np.nan))
+        for i, year in enumerate(self.years):
+            self._layers[(metric, year, threshold)] = np.ascontiguousarray(grid[:, i])
+
+    def layer(self, metric, threshold, year=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric, use one of: {', '.join(METRICS)}")
+        per_year = METRICS[metric][1]
+        if per_year and year is None:
+            raise ValueError("year is required for this metric")
+        values = self._layers.get((metric, year if per_year else None, threshold))
+        if values is None:
+            raise KeyError("No data for that year and density")
+        return values
+
+    def region_names(self):
+        return {
+            'names': [key[-1] for key in self.regions],
+            'states': [key[0] for key in self.regions] if self.level == 'district' else None
+        }
+
+    def nbytes(self):
+        return sum(values.nbytes for values in self._layers.values()) + sum(slots.nbytes for slots in self._slots.values())
+
+    def __len__(self):
+        return len(self._layers)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+import time
+
+
+class GeminiModel:
+    # Imports and configures the SDK on the first call, so importing an app never pays for it
+    def __init__(self, model_name, api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key or os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY'))
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate_content(self, prompt, **kwargs):
+        return self._client().generate_content(prompt, **kwargs)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self._client().generate_content_async(prompt, **kwargs)
+
+
+class FakeResponse:
+    def __init__(self, text, chunks=None):
+        self.text = text
+        self._chunks = chunks or [text]
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield FakeResponse(chunk)
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield FakeResponse(chunk)
+
+
+class FakeModel:
+    # Offline stand-in with the same interface, for tests and benchmarks
+    def __init__(self, delay=0.0, reply='Forest cover is stable.'):
+        # delay simulates upstream generation latency in seconds
+        self.delay = delay
+        self.reply = reply
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt):
+        with self._lock:
+            self.calls += 1
+        text = f'{self.reply} ({len(prompt)} prompt chars)'
+        return FakeResponse(text, [word + ' ' for word in text.split(' ')])
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        time.sleep(self.delay)
+        return self._respond(prompt)
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._respond(prompt)
+
+
+BACKENDS = {
+    'gemini': GeminiModel,
+    'fake': lambda model_name: FakeModel(delay=float(os.getenv('LLM_FAKE_DELAY', 0)))
+}
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(model_name, backend=None):
+    # One client per (backend, model) per process, shared by every app that asks for it
+    backend = backend or os.getenv('LLM_BACKEND', 'gemini')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {backend}, use one of: {', '.join(BACKENDS)}")
+    with _lock:
+        model = _models.get((backend, model_name))
+        if model is None:
+            model = _models[(backend, model_name)] = BACKENDS[backend](model_name)
+        return model
@@ -0,0 +1,56 @@
+import threading
+from collections import Counter
+
+
+class DemandTracker:
+    # Counts requests per key, e.g. (country, location, density), so the hottest can be warmed ahead of time
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, *key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def top(self, n):
+        with self._lock:
+            return [key for key, _ in self._counts.most_common(n)]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class Prewarmer:
+    # Background job: every `interval` seconds run warm(*key) for the top-N keys
+    def __init__(self, demand, warm, top_n=20, interval=600):
+        self.demand = demand
+        self.warm = warm
+        self.top_n = top_n
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        warmed = 0
+        for key in self.demand.top(self.top_n):
+            if self._stop.is_set():
+                break
+            try:
+                warmed += bool(self.warm(*key))
+            except Exception as e:
+                print(f"Pre-generation error for {key}: {str(e)}")
+        return warmed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        # A forked worker inherits the attribute but not the thread
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='llm-prewarm', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,109 @@
+import numpy as np
+from location_index import normalize
+
+# metric -> (sheet, unit)
+METRICS = {
+    'loss': ('tree', 'hectares'),
+    'emissions': ('carbon', 'Mg CO₂e'),
+    'carbon_stocks': ('carbon', 'Mg C'),
+    'net_change': ('tree', 'hectares'),
+    'percent_change': ('tree', '%')
+}
+THRESHOLD_COLUMNS = {
+    'carbon': 'umd_tree_cover_density_2000__threshold',
+    'tree': 'threshold'
+}
+LEVELS = ('state', 'district')
+
+
+def year_window(series, start=None, end=None):
+    years = np.asarray(series.years)
+    start = years[0] if start is None else start
+    end = years[-1] if end is None else end
+    if start > end:
+        raise ValueError("start year must not be after end year")
+    window = (years >= start) & (years <= end)
+    if not window.any():
+        raise ValueError(f"No yearly data between {start} and {end}")
+    return window, int(years[window][0]), int(years[window][-1])
+
+
+def metric_values(dataset, metric, level, rows, window):
+    sheet_name, _ = METRICS[metric]
+    frame = dataset.carbon(level) if sheet_name == 'carbon' else dataset.tree(level)
+    series = dataset.series(level)
+    if metric == 'carbon_stocks':
+        return frame['gfw_aboveground_carbon_stocks_2000__Mg_C'].to_numpy(dtype=float)[rows]
+    if metric == 'emissions':
+        return np.nansum(series.emissions[rows][:, window].astype(float), axis=1)
+    loss = np.nansum(series.tree_loss[rows][:, window].astype(float), axis=1)
+    if metric == 'loss':
+        return loss
+    net_change = frame['gain_2000-2020_ha'].to_numpy(dtype=float)[rows] - loss
+    if metric == 'net_change':
+        return net_change
+    extent = frame['extent_2000_ha'].to_numpy(dtype=float)[rows]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(extent != 0, net_change / extent * 100, 0.0)
+
+
+def top_k(values, k, descending=True):
+    # Partial selection so only the k winners get sorted; missing values rank last
+    keyed = np.where(np.isnan(values), -np.inf if descending else np.inf, values)
+    if descending:
+        keyed = -keyed
+    if k < len(keyed):
+        candidates = np.argpartition(keyed, k - 1)[:k]
+    else:
+        candidates = np.arange(len(keyed))
+    return candidates[np.lexsort((candidates, keyed[candidates]))]
+
+
+def rank(dataset, metric, threshold, level='district', state=None, start=None, end=None, top=10, order='desc'):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric, use one of: {', '.join(METRICS)}")
+    if level not in LEVELS:
+        raise ValueError("Invalid location level")
+    if state is not None and level != 'district':
+        raise ValueError("state only applies to district rankings")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    if top < 1:
+        raise ValueError("top must be positive")
+
+    sheet_name, unit = METRICS[metric]
+    frame = dataset.carbon(level) if sheet_name == 'carbon' else dataset.tree(level)
+    mask = frame[THRESHOLD_COLUMNS[sheet_name]].to_numpy() == threshold
+    if state is not None:
+        mask &= frame['state'].str.lower().to_numpy() == normalize(state)
+    rows = np.flatnonzero(mask)
+
+    window, first_year, last_year = year_window(dataset.series(level), start, end)
+    values = metric_values(dataset, metric, level, rows, window)
+    winners = top_k(values, top, descending=order == 'desc')
+
+    names = frame[level].to_numpy()
+    states = frame['state'].to_numpy()
+    results = []
+    for position, i in enumerate(winners.tolist(), start=1):
+        row = rows[i]
+        entry = {
+            'rank': position,
+            'name': names[row],
+            'value': None if np.isnan(values[i]) else float(values[i])
+        }
+        if level == 'district':
+            entry['state'] = states[row]
+        results.append(entry)
+
+    return {
+        'metric': metric,
+        'unit': unit,
+        'level': level,
+        'state': state,
+        'density_threshold': threshold,
+        'years': {'start': first_year, 'end': last_year} if metric != 'carbon_stocks' else None,
+        'order': order,
+        'count': len(rows),
+        'results': results
+    }
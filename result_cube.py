@@ -0,0 +1,75 @@
+import os
+import threading
+from cachetools import LRUCache
+from location_index import LEVELS
+
+# Stands in for the caller's spelling of the location while a cell is serialized
+LOCATION_SENTINEL = '\x00location\x00'
+# Compressed bodies kept per cube, one per (cell, location spelling, encoding)
+ENCODED_BODIES = int(os.getenv('FOREST_ENCODED_BODIES', 8192))
+
+
+class ResultCube:
+    def __init__(self, dataset, render):
+        self.dataset = dataset
+        # render(level, key, threshold, compact) -> (head, tail) response body halves
+        self._render = render
+        self._cells = {}
+        self._encoded = LRUCache(maxsize=ENCODED_BODIES)
+        self._lock = threading.Lock()
+        self.materialized = False
+        self.country_thresholds = {
+            float(t) for t in dataset.carbon('country')['umd_tree_cover_density_2000__threshold'].unique()
+        }
+
+    def cell(self, level, key, threshold, compact=False):
+        cell_key = (level, key, threshold, compact)
+        cell = self._cells.get(cell_key)
+        if cell is None:
+            cell = self._render(level, key, threshold, compact)
+            with self._lock:
+                cell = self._cells.setdefault(cell_key, cell)
+        return cell
+
+    def body(self, level, key, threshold, location=None, encode=None, compact=False):
+        head, tail = self.cell(level, key, threshold, compact)
+        if tail is None:
+            return head
+        return head + encode(location) + tail
+
+    def encoded_body(self, level, key, threshold, encoding, encode_body, location=None, encode=None, compact=False):
+        # encode_body(body, encoding) -> (body, encoding or None), run once per variant instead of per request
+        if encoding is None:
+            return self.body(level, key, threshold, location, encode, compact), None
+        encoded_key = (level, key, threshold, compact, location, encoding)
+        with self._lock:
+            encoded = self._encoded.get(encoded_key)
+        if encoded is None:
+            encoded = encode_body(self.body(level, key, threshold, location, encode, compact), encoding)
+            with self._lock:
+                self._encoded[encoded_key] = encoded
+        return encoded
+
+    def cells(self):
+        yield 'country', None, sorted(self.country_thresholds)
+        for level in LEVELS:
+            for key in self.dataset.index.names(level):
+                yield level, key, self.dataset.index.get(level, key).thresholds
+
+    def materialize(self):
+        count = 0
+        for level, key, thresholds in self.cells():
+            for threshold in thresholds:
+                self.cell(level, key, float(threshold))
+                count += 1
+        self.materialized = True
+        return count
+
+    def nbytes(self):
+        # Response bodies held so far, private to the worker
+        with self._lock:
+            encoded = sum(len(body) for body, _ in self._encoded.values())
+        return encoded + sum(len(head) + len(tail or b'') for head, tail in list(self._cells.values()))
+
+    def __len__(self):
+        return len(self._cells)
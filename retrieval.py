@@ -0,0 +1,183 @@
+import re
+import threading
+
+import numpy as np
+
+from location_index import LEVELS, THRESHOLD_COLUMNS, normalize
+from trends import RECENT_YEARS, direction
+
+WORD = re.compile(r'[A-Za-z0-9]+')
+DENSITY = re.compile(r'(\d+(?:\.\d+)?)\s*(?:%|percent)', re.IGNORECASE)
+DEFAULT_DENSITY = 30.0
+MAX_FACTS = 3
+
+# Joins names ("Dadra and Nagar Haveli", "Lahul & Spiti") and questions alike, so it is dropped from both
+CONNECTORS = {'and'}
+# Everyday English words that are also one-word place names ("West", "Mon", "Bid"); these only
+# match when capitalized mid-sentence, every other name matches in any case
+STOPWORDS = frozenset({
+    'a', 'about', 'all', 'an', 'any', 'are', 'as', 'at', 'be', 'bid', 'but', 'by', 'can', 'central',
+    'do', 'does', 'east', 'for', 'from', 'has', 'have', 'how', 'i', 'if', 'in', 'is', 'it', 'its',
+    'me', 'mon', 'my', 'new', 'no', 'north', 'not', 'of', 'on', 'or', 'our', 'south', 'the', 'this',
+    'to', 'upper', 'lower', 'was', 'we', 'west', 'what', 'when', 'where', 'which', 'who', 'why',
+    'will', 'with', 'you'
+})
+
+
+def words(text):
+    return [word.lower() for word in WORD.findall(str(text)) if word.lower() not in CONNECTORS]
+
+
+def _amount(value, unit):
+    return None if np.isnan(value) else f"{value:,.0f} {unit}"
+
+
+class FactIndex:
+    # Inverted index from location-name word sequences to compact fact snippets, so a chat
+    # prompt carries only the figures for the places the question mentions
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.thresholds = sorted(float(t) for t in dataset.tree('country')['threshold'].unique())
+        self._phrases = {}
+        self._longest = 1
+        self._facts = {}
+        self._lock = threading.Lock()
+
+        for level in LEVELS:
+            for key in dataset.index.names(level):
+                self._add(words(key), (level, key))
+        self.country_key = normalize(dataset.country_name)
+        self._add(words(self.country_key), ('country', self.country_key))
+        self.facts(DEFAULT_DENSITY)
+
+    def _add(self, phrase, target):
+        if not phrase:
+            return
+        # States win over districts of the same name, as in LocationIndex.resolve
+        self._phrases.setdefault(tuple(phrase), target)
+        self._longest = max(self._longest, len(phrase))
+
+    def match(self, message, limit=MAX_FACTS):
+        # Longest phrase first at every position: "Uttar Pradesh" before any shorter name inside it
+        raw = [word for word in WORD.findall(message) if word.lower() not in CONNECTORS]
+        tokens = [word.lower() for word in raw]
+        found = []
+        i = 0
+        while i < len(tokens) and len(found) < limit:
+            for n in range(min(self._longest, len(tokens) - i), 0, -1):
+                target = self._phrases.get(tuple(tokens[i:i + n]))
+                if target is None or (n == 1 and tokens[i] in STOPWORDS and not (i > 0 and raw[i][0].isupper())):
+                    continue
+                if target not in found:
+                    found.append(target)
+                i += n
+                break
+            else:
+                i += 1
+        return found
+
+    def density(self, message):
+        for value in DENSITY.findall(message):
+            if float(value) in self.thresholds:
+                return float(value)
+        return DEFAULT_DENSITY
+
+    def facts(self, threshold):
+        facts = self._facts.get(threshold)
+        if facts is None:
+            with self._lock:
+                facts = self._facts.get(threshold)
+                if facts is None:
+                    facts = self._facts[threshold] = self._build(threshold)
+        return facts
+
+    def nbytes(self):
+        # Snippet text of the densities built so far
+        return sum(len(snippet.encode()) for facts in list(self._facts.values())
+                   for snippets in facts.values() for snippet in snippets)
+
+    def __len__(self):
+        return sum(len(snippets) for facts in list(self._facts.values()) for snippets in facts.values())
+
+    def lookup(self, message, limit=MAX_FACTS):
+        # A district name shared by several states contributes one snippet per state
+        facts = self.facts(self.density(message))
+        snippets = [snippet for target in self.match(message, limit) for snippet in facts.get(target, [])]
+        return snippets[:limit]
+
+    def _exact_rows(self, sheet, level, threshold):
+        # First row per name at this threshold, names compared whole rather than by substring
+        frame = getattr(self.dataset, sheet)(level)
+        column = THRESHOLD_COLUMNS[sheet]
+        rows = {}
+        for row, (name, value) in enumerate(zip(frame[level], frame[column].to_numpy().tolist())):
+            if value == threshold:
+                rows.setdefault(normalize(name), row)
+        return rows
+
+    def _rows(self, level, threshold):
+        # (target, carbon row, tree row) for every location with data at this threshold, taken
+        # from rows whose name is exactly the target's
+        if level == 'country':
+            carbon = np.flatnonzero(self.dataset.carbon(level)[THRESHOLD_COLUMNS['carbon']].to_numpy() == threshold)
+            tree = np.flatnonzero(self.dataset.tree(level)[THRESHOLD_COLUMNS['tree']].to_numpy() == threshold)
+            if len(carbon) and len(tree):
+                return [(('country', self.country_key), carbon[0], tree[0])]
+            return []
+        rows = []
+        if level == 'state':
+            carbon = self._exact_rows('carbon', level, threshold)
+            tree = self._exact_rows('tree', level, threshold)
+            for key in self.dataset.index.names(level):
+                if key in carbon and key in tree:
+                    rows.append(((level, key), carbon[key], tree[key]))
+            return rows
+        # Districts come per state, so a name used in two states yields both rows
+        for state in self.dataset.index.names('state'):
+            for entry in self.dataset.index.districts_of(state) or []:
+                carbon_row, tree_row = entry.rows(threshold)
+                if carbon_row is not None and tree_row is not None:
+                    rows.append(((level, entry.key), carbon_row, tree_row))
+        return rows
+
+    def _build(self, threshold):
+        facts = {}
+        for level in ['country'] + LEVELS:
+            rows = self._rows(level, threshold)
+            if not rows:
+                continue
+            carbon_rows = np.array([row for _, row, _ in rows])
+            tree_rows = np.array([row for _, _, row in rows])
+            carbon, tree = self.dataset.carbon(level), self.dataset.tree(level)
+            tables = self.dataset.trends(level)
+            start = int(tables['tree_loss'].years[-RECENT_YEARS:][0])
+
+            # Every location of the level in one vectorized pass over the trend tables
+            loss = tables['tree_loss'].window(tree_rows)
+            recent = tables['tree_loss'].window(tree_rows, start)
+            emissions = tables['emissions'].window(carbon_rows, start)
+            extent = tree['extent_2000_ha'].to_numpy(dtype=float)[tree_rows]
+            gain = tree['gain_2000-2020_ha'].to_numpy(dtype=float)[tree_rows]
+            stocks = carbon['gfw_aboveground_carbon_stocks_2000__Mg_C'].to_numpy(dtype=float)[carbon_rows]
+            states = tree['state'].to_numpy()[tree_rows] if level == 'district' else None
+            first, last = loss['years']
+            recent_first, recent_last = recent['years']
+
+            for i, (target, _, _) in enumerate(rows):
+                if level == 'country':
+                    name = self.dataset.country_name
+                else:
+                    name = self.dataset.index.get(level, target[1]).name
+                    name = f"{name} district, {states[i]}" if level == 'district' else f"{name} state"
+                parts = [
+                    _amount(extent[i], 'ha tree cover in 2000'),
+                    _amount(gain[i], 'ha gain 2000-2020'),
+                    _amount(stocks[i], 'Mg aboveground carbon'),
+                    _amount(loss['total'][i], f'ha tree cover loss {first}-{last}'),
+                    _amount(recent['mean'][i], f'ha/yr average loss {recent_first}-{recent_last} '
+                                               f'({direction(recent["slope"][i])})'),
+                    _amount(emissions['mean'][i], f'Mg CO2e/yr average emissions {recent_first}-{recent_last}')
+                ]
+                snippet = f"{name}, canopy >= {threshold:g}%: " + '; '.join(part for part in parts if part)
+                facts.setdefault(target, []).append(snippet)
+        return facts
@@ -0,0 +1,13 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def connect(db_path, timeout=5):
+    # One short-lived connection per call so threads and workers never share one
+    db = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
@@ -0,0 +1,114 @@
+import numpy as np
+
+# Regression x values are years since ORIGIN so prefix sums stay valid when years are appended
+ORIGIN = 2000
+RECENT_YEARS = 5
+
+
+def _extend(prefix, tail):
+    # Continue running sums from the last column of an existing prefix
+    total = np.cumsum(tail, axis=1)
+    if prefix is None:
+        return total
+    return np.concatenate([prefix, total + prefix[:, -1:]], axis=1)
+
+
+def _lag(prefix, size):
+    lagged = np.zeros_like(prefix)
+    if size < prefix.shape[-1]:
+        lagged[..., size:] = prefix[..., :-size]
+    return lagged
+
+
+class TrendTable:
+    # Prefix sums over a (rows x years) matrix; any window's mean, slope and total are O(rows)
+    def __init__(self, years, values, base=None):
+        self.years = np.asarray(years)
+        self.values = values
+        start = len(base.years) if base is not None and base.extends_to(self.years, values) else 0
+        self.recomputed_from = start
+
+        # float64 sums whatever the storage dtype of the yearly matrix
+        tail = values[:, start:].astype(float)
+        present = ~np.isnan(tail)
+        filled = np.where(present, tail, 0.0)
+        x = (self.years[start:] - ORIGIN).astype(float)
+        prior = base if start else None
+        self.count = _extend(prior.count if prior else None, present.astype(float))
+        self.total = _extend(prior.total if prior else None, filled)
+        self.x_total = _extend(prior.x_total if prior else None, present * x)
+        self.xx_total = _extend(prior.xx_total if prior else None, present * x * x)
+        self.xy_total = _extend(prior.xy_total if prior else None, filled * x)
+
+        # Year-over-year deltas; the first year has no predecessor
+        previous = base.values[:, start - 1:start] if start else np.full((len(values), 1), np.nan)
+        self.yoy = np.diff(np.concatenate([previous, tail], axis=1), axis=1)
+        if start:
+            self.yoy = np.concatenate([base.yoy, self.yoy], axis=1)
+
+    def extends_to(self, years, values):
+        # True when the new table only appends years to this one
+        n = len(self.years)
+        return (len(years) >= n and values.shape[0] == self.values.shape[0]
+                and np.array_equal(years[:n], self.years)
+                and np.array_equal(values[:, :n], self.values, equal_nan=True))
+
+    def bounds(self, start=None, end=None):
+        start = self.years[0] if start is None else start
+        end = self.years[-1] if end is None else end
+        columns = np.flatnonzero((self.years >= start) & (self.years <= end))
+        if len(columns) == 0:
+            raise ValueError(f"No yearly data between {start} and {end}")
+        return columns[0], columns[-1]
+
+    def _span(self, prefix, rows, first, last):
+        before = prefix[rows, first - 1].astype(float) if first > 0 else 0.0
+        return prefix[rows, last].astype(float) - before
+
+    def window(self, rows, start=None, end=None):
+        # Summary of the years in [start, end] for the given rows
+        first, last = self.bounds(start, end)
+        n = self._span(self.count, rows, first, last)
+        total = self._span(self.total, rows, first, last)
+        sx = self._span(self.x_total, rows, first, last)
+        sxx = self._span(self.xx_total, rows, first, last)
+        sxy = self._span(self.xy_total, rows, first, last)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, total / n, np.nan)
+            denominator = n * sxx - sx * sx
+            slope = np.where(denominator > 0, (n * sxy - sx * total) / denominator, np.nan)
+        return {
+            'years': (int(self.years[first]), int(self.years[last])),
+            'count': n,
+            'total': np.where(n > 0, total, np.nan),
+            'mean': mean,
+            'slope': slope
+        }
+
+    def rolling_mean(self, rows, size):
+        # Mean of the trailing `size` years at every year, NaN until a value is seen
+        count, total = self.count[rows].astype(float), self.total[rows].astype(float)
+        count = count - _lag(count, size)
+        total = total - _lag(total, size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def cumulative(self, rows):
+        return np.where(self.count[rows] > 0, self.total[rows].astype(float), np.nan)
+
+
+def build_tables(series, base=None):
+    return {
+        'tree_loss': TrendTable(series.years, series.tree_loss, base['tree_loss'] if base else None),
+        'emissions': TrendTable(series.years, series.emissions, base['emissions'] if base else None)
+    }
+
+
+def direction(slope):
+    if np.isnan(slope):
+        return 'insufficient data'
+    if slope > 0:
+        return 'increasing'
+    if slope < 0:
+        return 'decreasing'
+    return 'stable'